@@ -0,0 +1,145 @@
+"""
+Benchmark: HTTP/1.1 connection pool vs HTTP/2 multiplexed transport for concurrent streaming turns.
+
+Starts an SSE upstream (hypercorn, speaks HTTP/1.1 and h2c) in a separate process, runs the same number of
+concurrent streaming requests through both transports and reports peak client socket count and latency
+percentiles.
+
+Usage:
+    pip install hypercorn "httpx[http2]"
+    python -m benchmarks.http_transport --concurrency 300 --chunks 20 --chunk-delay 0.02
+    python -m benchmarks.http_transport --url http://localhost:8042/health   # against a running service
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+from typing import Optional
+
+import httpx
+
+from task.transport import create_transport
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+def _serve(port: int) -> None:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    async def upstream(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        query = dict(p.split("=") for p in scope["query_string"].decode().split("&") if "=" in p)
+        chunks, delay = int(query.get("chunks", 10)), float(query.get("delay", 0.01))
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        for i in range(chunks):
+            await asyncio.sleep(delay)
+            await send({"type": "http.response.body", "body": f"data: {i}\n\n".encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"data: [DONE]\n\n"})
+
+    config = Config()
+    config.bind = [f"{HOST}:{port}"]
+    config.loglevel = "WARNING"
+    config.h2_max_concurrent_streams = 1000
+    asyncio.run(serve(upstream, config))
+
+
+def _open_sockets() -> int:
+    fd_dir = "/proc/self/fd"
+    count = 0
+    for fd in os.listdir(fd_dir):
+        try:
+            count += os.readlink(os.path.join(fd_dir, fd)).startswith("socket:")
+        except OSError:
+            pass
+    return count
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+
+async def _run(url: str, http2: bool, concurrency: int, max_streams: int) -> dict[str, float]:
+    transport = create_transport(
+        name="benchmark",
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=1000),
+        http2=http2,
+        max_streams_per_connection=max_streams,
+    )
+    baseline = _open_sockets()
+    peak = 0
+    done = asyncio.Event()
+
+    async def sample_sockets():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, _open_sockets() - baseline)
+            await asyncio.sleep(0.005)
+
+    async def turn(client: httpx.AsyncClient) -> float:
+        started = time.perf_counter()
+        async with client.stream("GET", url) as response:
+            async for _ in response.aiter_lines():
+                pass
+        return time.perf_counter() - started
+
+    async with httpx.AsyncClient(transport=transport, timeout=60) as client:
+        sampler = asyncio.create_task(sample_sockets())
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(turn(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+
+    return {
+        "sockets": peak,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "max": max(latencies),
+        "mean": statistics.mean(latencies),
+        "elapsed": elapsed,
+    }
+
+
+async def main(url: Optional[str], concurrency: int, max_streams: int, rounds: int) -> None:
+    for http2 in (False, True):
+        label = f"HTTP/2 ({max_streams} streams/conn)" if http2 else "HTTP/1.1"
+        for round_idx in range(rounds):
+            r = await _run(url, http2, concurrency, max_streams)
+            print(
+                f"{label:<28} round={round_idx + 1} concurrency={concurrency} sockets={r['sockets']:<4} "
+                f"p50={r['p50'] * 1000:.0f}ms p95={r['p95'] * 1000:.0f}ms p99={r['p99'] * 1000:.0f}ms "
+                f"max={r['max'] * 1000:.0f}ms total={r['elapsed']:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Target URL, by default a local SSE upstream is started")
+    parser.add_argument("--concurrency", type=int, default=300)
+    parser.add_argument("--max-streams", type=int, default=100, help="Max concurrent streams per HTTP/2 connection")
+    parser.add_argument("--chunks", type=int, default=20, help="SSE chunks per response (local upstream)")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Delay between chunks (local upstream)")
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+
+    server: Optional[multiprocessing.Process] = None
+    target = args.url
+    if target is None:
+        server = multiprocessing.Process(target=_serve, args=(PORT,), daemon=True)
+        server.start()
+        time.sleep(1.5)
+        target = f"http://{HOST}:{PORT}/stream?chunks={args.chunks}&delay={args.chunk_delay}"
+
+    try:
+        asyncio.run(main(target, args.concurrency, args.max_streams, args.rounds))
+    finally:
+        if server is not None:
+            server.terminate()
@@ -0,0 +1,164 @@
+"""
+Benchmark: application import time and cold start with a failing budget.
+
+Reports import time per module for `task.app` (median of several interpreter runs, from `python -X importtime`)
+and cold-start time of `python -m task.app` until the first request is served (`/ready` answers at all)
+and until the worker reports ready (downstream warm-up finished). Exits with code 1 when a budget is exceeded.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --import-budget-ms 800 --cold-start-budget-ms 2000
+"""
+
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Optional
+
+IMPORT_BUDGET_MS = float(os.getenv('STARTUP_IMPORT_BUDGET_MS', '1000'))
+COLD_START_BUDGET_MS = float(os.getenv('STARTUP_COLD_START_BUDGET_MS', '3000'))
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def _import_profile(module: str) -> dict[str, tuple[int, float]]:
+    """Cumulative import time (ms) of every module with its nesting depth, from a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, "LOG_LEVEL": "WARNING"},
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if match := _IMPORT_TIME.match(line):
+            _, cumulative, indent, name = match.groups()
+            entries.append((name, len(indent) // 2, int(cumulative) / 1000))
+
+    # Nested imports are printed before their parent, the module subtree ends at its own top-level line
+    end = next(i for i, (name, depth, _) in enumerate(entries) if name == module and depth == 0)
+    start = end
+    while start > 0 and entries[start - 1][1] > 0:
+        start -= 1
+    return {name: (depth, cumulative) for name, depth, cumulative in entries[start:end + 1]}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_status(url: str) -> Optional[int]:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def _cold_start(timeout: float, ready_timeout: float) -> tuple[Optional[float], Optional[float]]:
+    """Milliseconds from process spawn to the first served request and to readiness"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/ready"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "task.app"],
+        env={**os.environ, "HOST": "127.0.0.1", "PORT": str(port), "LOG_LEVEL": "WARNING"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    first_request = ready = None
+    try:
+        while time.perf_counter() - started < timeout + ready_timeout:
+            status = _get_status(url)
+            elapsed = (time.perf_counter() - started) * 1000
+            if status is not None and first_request is None:
+                first_request = elapsed
+            if status == 200:
+                ready = elapsed
+                break
+            if first_request is None and elapsed > timeout * 1000:
+                break
+            if first_request is not None and elapsed - first_request > ready_timeout * 1000:
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return first_request, ready
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="task.app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to report")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--cold-start-budget-ms", type=float, default=COLD_START_BUDGET_MS)
+    parser.add_argument("--cold-start-timeout", type=float, default=30.0)
+    parser.add_argument("--ready-timeout", type=float, default=5.0, help="Wait for readiness after first request")
+    parser.add_argument("--skip-cold-start", action="store_true")
+    args = parser.parse_args()
+
+    # 1. Import time per module, median over fresh interpreters
+    samples: dict[str, list[float]] = defaultdict(list)
+    depths: dict[str, int] = {}
+    for _ in range(args.runs):
+        for name, (depth, cumulative) in _import_profile(args.module).items():
+            samples[name].append(cumulative)
+            depths[name] = depth
+    medians = {name: statistics.median(values) for name, values in samples.items()}
+    import_total = medians[args.module]
+
+    print(f"Import time of {args.module}: {import_total:.0f}ms (median of {args.runs} runs)")
+    print("\nApplication modules:")
+    for name, value in sorted(medians.items(), key=lambda item: -item[1]):
+        if name.split(".")[0] == args.module.split(".")[0]:
+            print(f"  {value:8.1f}ms  {name}")
+    print(f"\nSlowest modules imported by application (top {args.top}):")
+    direct = [name for name in medians if depths[name] == 1 and name != args.module]
+    for name in sorted(direct, key=lambda name: -medians[name])[:args.top]:
+        print(f"  {medians[name]:8.1f}ms  {name}")
+
+    failures = []
+    if import_total > args.import_budget_ms:
+        failures.append(f"import time {import_total:.0f}ms exceeds budget {args.import_budget_ms:.0f}ms")
+
+    # 2. Cold start of the server process
+    if not args.skip_cold_start:
+        first_request, ready = _cold_start(args.cold_start_timeout, args.ready_timeout)
+        print()
+        if first_request is None:
+            print("Cold start: server did not answer")
+            failures.append("server did not answer within cold start timeout")
+        else:
+            print(f"Cold start to first request served: {first_request:.0f}ms")
+            print(
+                f"Cold start to ready: {ready:.0f}ms" if ready is not None
+                else f"Cold start to ready: not ready within {args.ready_timeout:.0f}s (downstream services unreachable?)"
+            )
+            if first_request > args.cold_start_budget_ms:
+                failures.append(
+                    f"cold start {first_request:.0f}ms exceeds budget {args.cold_start_budget_ms:.0f}ms"
+                )
+
+    print()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK: startup within budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,121 +1,234 @@
 import json
-from copy import deepcopy
-from typing import Any
+from typing import Any, Optional, TYPE_CHECKING
 
-from aidial_client import AsyncDial
-from aidial_sdk.chat_completion import Role, Choice, Request, Message, Stage
+from aidial_sdk.chat_completion import Role, Choice, Request, Message, Stage, CustomContent
+from aidial_sdk.chat_completion.request import MessageContentTextPart
 from pydantic import StrictStr
 
-from task.coordination.gpa import GPAGateway
+from task.compaction import ContextCompactor
+from task.connections import DIAL_API_VERSION, pools
+from task.coordination.gpa import GPAGateway, _IS_GPA
 from task.coordination.ums_agent import UMSAgentGateway
 from task.logging_config import get_logger
-from task.models import CoordinationRequest, AgentName
-from task.prompts import COORDINATION_REQUEST_SYSTEM_PROMPT, FINAL_RESPONSE_SYSTEM_PROMPT
+from task.models import CoordinationRequest, AgentName, OperationType
+from task.prompt_assembly import prompt_assembler
+from task.response_cache import ResponseCache, CachedResponse
+from task.speculation import SpeculativeDispatch
+from task.usage import UsageTracker
 from task.stage_util import StageProcessor
 
+if TYPE_CHECKING:
+    from aidial_client import AsyncDial
+
 logger = get_logger(__name__)
 
 
 class MASCoordinator:
 
-    def __init__(self, endpoint: str, deployment_name: str, ums_agent_endpoint: str):
+    def __init__(
+            self,
+            endpoint: str,
+            deployment_name: str,
+            ums_agent_endpoint: str,
+            response_cache: Optional[ResponseCache] = None,
+            context_compactor: Optional[ContextCompactor] = None,
+            speculative_agents: frozenset[AgentName] = frozenset(),
+            usage_tracker: Optional[UsageTracker] = None,
+            caller_id: str = ''
+    ):
         self.endpoint = endpoint
         self.deployment_name = deployment_name
         self.ums_agent_endpoint = ums_agent_endpoint
+        self.response_cache = response_cache
+        self.context_compactor = context_compactor
+        self.speculative_agents = speculative_agents
+        self.usage_tracker = usage_tracker or UsageTracker()
+        self.caller_id = caller_id
 
     async def handle_request(self, choice: Choice, request: Request) -> Message:
-        # 1. Create AsyncDial client
-        client: AsyncDial = AsyncDial(
-            base_url=self.endpoint,
-            api_key=request.api_key,
-            api_version='2025-01-01-preview'
-        )
+        # 1. Create AsyncDial client on top of the worker connection pool
+        client: "AsyncDial" = pools.create_dial_client(base_url=self.endpoint, api_key=request.api_key)
 
         # 2. Open stage for Coordination Request
         coordination_stage = StageProcessor.open_stage(choice, "Coordination Request")
         
-        # 3. Prepare coordination request
-        coordination_request = await self.__prepare_coordination_request(
-            client=client,
-            request=request,
-        )
-        logger.info(f"coordination_request: {coordination_request.model_dump_json()}")
-        
-        # 4. Add to the stage and close it
-        coordination_stage.append_content(f"```json\n\r{coordination_request.model_dump_json(indent=2)}\n\r```\n\r")
-        StageProcessor.close_stage_safely(coordination_stage)
+        # 3. Prepare coordination request, speculatively calling previous turn agent in parallel
+        history = prompt_assembler.history(request)
+        speculation = self.__start_speculation(choice, request)
+        try:
+            coordination_request = await self.__prepare_coordination_request(
+                client=client,
+                request=request,
+                history=history,
+            )
+            logger.info(f"coordination_request: {coordination_request.model_dump_json()}")
 
-        # 5. Handle coordination request
-        processing_stage = StageProcessor.open_stage(choice, f"Call {coordination_request.agent_name} Agent")
-        agent_message = await self.__handle_coordination_request(
-            coordination_request=coordination_request,
-            choice=choice,
-            stage=processing_stage,
-            request=request,
-        )
+            # 4. Add to the stage and close it
+            coordination_stage.append_content(f"```json\n\r{coordination_request.model_dump_json(indent=2)}\n\r```\n\r")
+            StageProcessor.close_stage_safely(coordination_stage)
+
+            # 5. Serve read-only turns from response cache
+            cache_text = self.__get_cache_text(request, coordination_request)
+            cached = cache_text and self.response_cache.get(self.caller_id, coordination_request.agent_name, cache_text)
+            if cached:
+                logger.info(f"Serving {coordination_request.agent_name} response from cache")
+                if speculation:
+                    await speculation.cancel()
+                return self.__replay_cached_response(
+                    coordination_request=coordination_request,
+                    choice=choice,
+                    cached=cached,
+                )
+
+            # 6. Handle coordination request, committing speculative call if routing agrees with it
+            if speculation and speculation.matches(coordination_request):
+                agent_message = await speculation.commit()
+            else:
+                if speculation:
+                    await speculation.cancel()
+                processing_stage = StageProcessor.open_stage(choice, f"Call {coordination_request.agent_name} Agent")
+                agent_message = await self.__handle_coordination_request(
+                    coordination_request=coordination_request,
+                    choice=choice,
+                    stage=processing_stage,
+                    request=request,
+                )
+                StageProcessor.close_stage_safely(processing_stage)
+        except BaseException:
+            # Speculative agent call never outlives a failed or cancelled request
+            if speculation:
+                await speculation.cancel()
+            raise
         logger.info(f"Agent response: {agent_message.json()}")
-        StageProcessor.close_stage_safely(processing_stage)
 
-        # 6. Generate final response
+        # 7. Compact agent output to the synthesis token budget
+        context = agent_message.content or ''
+        if self.context_compactor:
+            compaction = await self.context_compactor.compact(
+                content=context,
+                query=lambda: self.__compaction_query(request),
+            )
+            context = compaction.content
+
+        # 8. Generate final response
         final_response = await self.__final_response(
             client=client,
             request=request,
+            history=history,
             choice=choice,
             agent_message=agent_message,
+            context=context,
         )
 
         logger.info(f"Final response: {final_response.json()}")
 
+        # 9. Cache read-only text answers, writes to UMS invalidate cached UMS answers
+        if self.response_cache:
+            if coordination_request.operation_type is OperationType.WRITE:
+                if coordination_request.agent_name is AgentName.UMS:
+                    self.response_cache.invalidate(AgentName.UMS)
+            elif cache_text and not (agent_message.custom_content and agent_message.custom_content.attachments):
+                self.response_cache.put(
+                    scope=self.caller_id,
+                    agent_name=coordination_request.agent_name,
+                    text=cache_text,
+                    agent_content=agent_message.content or '',
+                    final_content=final_response.content,
+                )
+
         return final_response
 
-    async def __prepare_coordination_request(self, client: AsyncDial, request: Request) -> CoordinationRequest:
-        # 1. Make call to LLM with structured output
+    def __start_speculation(self, choice: Choice, request: Request) -> Optional[SpeculativeDispatch]:
+        agent_name = SpeculativeDispatch.previous_agent(request)
+        if agent_name is None or agent_name not in self.speculative_agents:
+            return None
+
+        return SpeculativeDispatch.start(
+            agent_name=agent_name,
+            choice=choice,
+            run=lambda coordination_request, shadow_choice, stage: self.__handle_coordination_request(
+                coordination_request=coordination_request,
+                choice=shadow_choice,
+                stage=stage,
+                request=request,
+            ),
+        )
+
+    def __get_cache_text(self, request: Request, coordination_request: CoordinationRequest) -> Optional[str]:
+        if not self.response_cache or coordination_request.operation_type is not OperationType.READ:
+            return None
+
+        # Answers that depend on attached files are never shared
+        last_msg = request.messages[-1]
+        if last_msg.custom_content or not isinstance(last_msg.content, str):
+            return None
+
+        return ResponseCache.cache_text(last_msg.content, coordination_request.additional_instructions)
+
+    @staticmethod
+    def __compaction_query(request: Request) -> str:
+        # User request may be sent as content parts, only its text parts are relevant for sentence scoring
+        content = request.messages[-1].content
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return "\n".join(part.text for part in content if isinstance(part, MessageContentTextPart))
+        return ''
+
+    @staticmethod
+    def __replay_cached_response(
+            coordination_request: CoordinationRequest,
+            choice: Choice,
+            cached: CachedResponse
+    ) -> Message:
+        # 1. Stream cached agent output to the same stage as a live call
+        processing_stage = StageProcessor.open_stage(choice, f"Call {coordination_request.agent_name} Agent")
+        if cached.agent_content:
+            processing_stage.append_content(cached.agent_content)
+        StageProcessor.close_stage_safely(processing_stage)
+
+        # 2. Fresh state for this conversation: GPA turn without GPA internals, UMS keeps its own conversation id
+        custom_content = None
+        if coordination_request.agent_name is AgentName.GPA:
+            state = {_IS_GPA: True}
+            choice.set_state(state)
+            custom_content = CustomContent(state=state)
+
+        # 3. Stream cached final response
+        choice.append_content(cached.final_content)
+
+        return Message(
+            role=Role.ASSISTANT,
+            content=StrictStr(cached.final_content),
+            custom_content=custom_content
+        )
+
+    async def __prepare_coordination_request(
+            self,
+            client: "AsyncDial",
+            request: Request,
+            history: list[dict[str, Any]]
+    ) -> CoordinationRequest:
+        # 1. Make call to LLM with structured output, system prompt and schema are precompiled
+        msgs = prompt_assembler.coordination_messages(history)
+        prompt_assembler.track_prefix(request.headers.get('x-conversation-id'), "routing", msgs)
+
+        started = UsageTracker.start()
         response = await client.chat.completions.create(
-            messages=self.__prepare_messages(request, COORDINATION_REQUEST_SYSTEM_PROMPT),
+            messages=msgs,
             deployment_name=self.deployment_name,
-            extra_body={
-                "response_format": {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "response",
-                        "schema": CoordinationRequest.model_json_schema()
-                    }
-                },
-            }
+            api_version=DIAL_API_VERSION,
+            extra_body={"response_format": prompt_assembler.coordination_response_format},
         )
 
+        self.usage_tracker.record("routing", self.deployment_name, response.usage, started)
+
         # 2-3. Get content and load as dict
         dict_content = json.loads(response.choices[0].message.content)
         
         # 4. Create CoordinationRequest from result
         return CoordinationRequest.model_validate(dict_content)
 
-    def __prepare_messages(self, request: Request, system_prompt: str) -> list[dict[str, Any]]:
-        # 1. Create array with messages, first is system prompt
-        msgs = [
-            {
-                "role": Role.SYSTEM,
-                "content": system_prompt,
-            }
-        ]
-        
-        # 2. Iterate through messages from request
-        for msg in request.messages:
-            if msg.role == Role.USER and msg.custom_content:
-                # User message with custom content - skip custom content
-                copied_msg = deepcopy(msg)
-                msgs.append(
-                    {
-                        "role": Role.USER,
-                        "content": StrictStr(copied_msg.content),
-                    }
-                )
-            else:
-                # Otherwise append as dict with excluded none
-                msgs.append(msg.dict(exclude_none=True))
-
-        return msgs
-
     async def __handle_coordination_request(
             self,
             coordination_request: CoordinationRequest,
@@ -125,7 +238,7 @@ class MASCoordinator:
     ) -> Message:
         # Make appropriate coordination requests to proper agents
         if coordination_request.agent_name is AgentName.GPA:
-            return await GPAGateway(endpoint=self.endpoint).response(
+            return await GPAGateway(endpoint=self.endpoint, usage_tracker=self.usage_tracker).response(
                 choice=choice,
                 request=request,
                 stage=stage,
@@ -133,7 +246,10 @@ class MASCoordinator:
             )
 
         elif coordination_request.agent_name is AgentName.UMS:
-            return await UMSAgentGateway(ums_agent_endpoint=self.ums_agent_endpoint).response(
+            return await UMSAgentGateway(
+                ums_agent_endpoint=self.ums_agent_endpoint,
+                usage_tracker=self.usage_tracker,
+            ).response(
                 choice=choice,
                 request=request,
                 stage=stage,
@@ -143,34 +259,41 @@ class MASCoordinator:
             raise ValueError("Unknown Agent Name")
 
     async def __final_response(
-            self, client: AsyncDial,
+            self, client: "AsyncDial",
             choice: Choice,
             request: Request,
-            agent_message: Message
+            history: list[dict[str, Any]],
+            agent_message: Message,
+            context: str
     ) -> Message:
-        # 1. Prepare messages with FINAL_RESPONSE_SYSTEM_PROMPT
-        msgs = self.__prepare_messages(request, FINAL_RESPONSE_SYSTEM_PROMPT)
+        # 1-3. Prepare messages with FINAL_RESPONSE_SYSTEM_PROMPT, agent context goes only to the last message
+        msgs = prompt_assembler.final_messages(history, context)
+        prompt_assembler.track_prefix(request.headers.get('x-conversation-id'), "synthesis", msgs, dynamic_tail=1)
 
-        # 2-3. Make augmentation of agent response with user request
-        updated_user_request = f"## CONTEXT:\n {agent_message.content}\n ---\n ## USER_REQUEST: \n {msgs[-1]['content']}"
-        msgs[-1]["content"] = updated_user_request
-
-        # 4. Call LLM with streaming
+        # 4. Call LLM with streaming, usage arrives in the last chunk
+        started = UsageTracker.start()
         chunks = await client.chat.completions.create(
             stream=True,
             messages=msgs,
-            deployment_name=self.deployment_name
+            deployment_name=self.deployment_name,
+            api_version=DIAL_API_VERSION,
+            extra_body={"stream_options": {"include_usage": True}},
         )
 
         # 5. Stream final response to choice
         content = ''
+        usage = None
         async for chunk in chunks:
+            if chunk.usage:
+                usage = chunk.usage
             if chunk.choices and len(chunk.choices) > 0:
                 delta = chunk.choices[0].delta
                 if delta and delta.content:
                     choice.append_content(delta.content)
                     content += delta.content
 
+        self.usage_tracker.record("synthesis", self.deployment_name, usage, started)
+
         return Message(
             role=Role.ASSISTANT,
             content=StrictStr(content),
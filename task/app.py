@@ -1,68 +1,224 @@
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 
-import uvicorn
 from aidial_sdk import DIALApp
 from aidial_sdk.chat_completion import ChatCompletion, Request, Response
+from fastapi.responses import JSONResponse
 
 from task.agent import MASCoordinator
+from task.coalescing import RequestCoalescer
+from task.compaction import ContextCompactor
+from task.connections import pools
+from task.diagnostics import LoopLagMonitor, profile_request
 from task.logging_config import setup_logging, get_logger
+from task.metrics import metrics
+from task.models import AgentName
+from task.response_cache import ResponseCache
+from task.scheduler import TenantScheduler
+from task.server import HOST, PORT, WORKERS, server_state, run_production
+from task.usage import UsageTracker
 
 DIAL_ENDPOINT = os.getenv('DIAL_ENDPOINT', "http://localhost:8080")
 DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', 'gpt-4o')
 UMS_AGENT_ENDPOINT = os.getenv('UMS_AGENT_ENDPOINT', "http://localhost:8042")
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+REQUEST_COALESCING_ENABLED = os.getenv('REQUEST_COALESCING_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_GPA_TTL = float(os.getenv('RESPONSE_CACHE_GPA_TTL', '3600'))
+RESPONSE_CACHE_UMS_TTL = float(os.getenv('RESPONSE_CACHE_UMS_TTL', '300'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('RESPONSE_CACHE_SIMILARITY_THRESHOLD', '0'))
+LOOP_LAG_MONITOR_ENABLED = os.getenv('LOOP_LAG_MONITOR_ENABLED', 'true').lower() == 'true'
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))
+LOOP_LAG_SLOW_THRESHOLD = float(os.getenv('LOOP_LAG_SLOW_THRESHOLD', '0.25'))
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'x-profile-request')
+PROFILING_OUTPUT_DIR = os.getenv('PROFILING_OUTPUT_DIR', 'profiles')
+SERVER_MODE = os.getenv('SERVER_MODE', 'dev')
+WARM_UP_RETRY_DELAY = float(os.getenv('WARM_UP_RETRY_DELAY', '5'))
+WARM_UP_RETRY_MAX_DELAY = float(os.getenv('WARM_UP_RETRY_MAX_DELAY', '60'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '8000'))
+SPECULATIVE_DISPATCH_ENABLED = os.getenv('SPECULATIVE_DISPATCH_ENABLED', 'false').lower() == 'true'
+SPECULATIVE_AGENTS = frozenset(
+    AgentName(name.strip()) for name in os.getenv('SPECULATIVE_AGENTS', 'GPA').split(',') if name.strip()
+) if SPECULATIVE_DISPATCH_ENABLED else frozenset()
+# Scheduler limits are per worker process, the deployment-wide limit is the value multiplied by WORKERS
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', '64'))
+# Header carrying a stable caller identity (e.g. a project or user header set by the gateway). Without it callers
+# are told apart by API key, which behind DIAL Core may be issued per request: every request then becomes its own
+# tenant, per-tenant limits and weights never apply, and cached answers are not shared between conversations
+TENANT_HEADER = os.getenv('TENANT_HEADER', '')
+TENANT_MAX_CONCURRENCY = int(os.getenv('TENANT_MAX_CONCURRENCY', '8'))
+TENANT_RATE_LIMIT = float(os.getenv('TENANT_RATE_LIMIT', '5'))
+TENANT_BURST = float(os.getenv('TENANT_BURST', '20'))
+TENANT_MAX_QUEUE = int(os.getenv('TENANT_MAX_QUEUE', '32'))
+TENANT_QUEUE_TIMEOUT = float(os.getenv('TENANT_QUEUE_TIMEOUT', '30'))
+TENANT_WEIGHTS = {
+    tenant.strip(): float(weight)
+    for tenant, weight in (item.split('=', 1) for item in os.getenv('TENANT_WEIGHTS', '').split(',') if '=' in item)
+}
 
 setup_logging(log_level=LOG_LEVEL)
 logger = get_logger(__name__)
 
+if not TENANT_HEADER:
+    logger.warning(
+        "TENANT_HEADER is not set, tenants are identified by API key: with per-request keys every request is "
+        "a separate tenant and per-tenant limits do not apply"
+    )
+
+if AgentName.UMS in SPECULATIVE_AGENTS:
+    # A speculative UMS call cancelled because routing picked another agent may already have changed memories
+    logger.warning("UMS is not allowed in SPECULATIVE_AGENTS, its calls may write memories, ignoring it")
+    SPECULATIVE_AGENTS = SPECULATIVE_AGENTS - {AgentName.UMS}
+
 
 class MASCoordinatorApplication(ChatCompletion):
 
+    def __init__(self):
+        self.coalescer = RequestCoalescer()
+        # UMS writes invalidate only the cache of the worker that handled them, with several workers the others
+        # would keep serving stale memory reads, so UMS answers are cached only in single worker deployments
+        ums_cache_ttl = RESPONSE_CACHE_UMS_TTL
+        if SERVER_MODE == 'production' and WORKERS > 1 and ums_cache_ttl > 0:
+            logger.warning(f"UMS response caching disabled: invalidation is per process [workers={WORKERS}]")
+            ums_cache_ttl = 0
+        self.response_cache = ResponseCache(
+            ttls={
+                AgentName.GPA: RESPONSE_CACHE_GPA_TTL,
+                AgentName.UMS: ums_cache_ttl,
+            },
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            similarity_threshold=RESPONSE_CACHE_SIMILARITY_THRESHOLD or None,
+        ) if RESPONSE_CACHE_ENABLED else None
+        self.context_compactor = ContextCompactor(token_budget=CONTEXT_TOKEN_BUDGET) if CONTEXT_TOKEN_BUDGET > 0 else None
+        self.scheduler = TenantScheduler(
+            max_concurrency=MAX_CONCURRENT_REQUESTS,
+            tenant_concurrency=TENANT_MAX_CONCURRENCY,
+            rate=TENANT_RATE_LIMIT,
+            burst=TENANT_BURST,
+            max_queue=TENANT_MAX_QUEUE,
+            queue_timeout=TENANT_QUEUE_TIMEOUT,
+            weights=TENANT_WEIGHTS,
+        )
+        if SERVER_MODE == 'production' and WORKERS > 1:
+            logger.info(
+                f"Tenant limits apply per worker [workers={WORKERS}, effective_rate={TENANT_RATE_LIMIT * WORKERS}/s, "
+                f"effective_concurrency={TENANT_MAX_CONCURRENCY * WORKERS}]"
+            )
+
     async def chat_completion(self, request: Request, response: Response) -> None:
         conversation_id = request.headers.get('x-conversation-id', 'unknown')
         logger.info(f"Received chat completion request [conversation_id={conversation_id}]")
         logger.debug(f"Request details: {len(request.messages)} messages")
 
-        try:
-            with response.create_single_choice() as choice:
-                logger.debug(f"Created response choice [conversation_id={conversation_id}]")
-
-                await MASCoordinator(
-                    endpoint=DIAL_ENDPOINT,
-                    deployment_name=DEPLOYMENT_NAME,
-                    ums_agent_endpoint=UMS_AGENT_ENDPOINT
-                ).handle_request(
-                    choice=choice,
-                    request=request,
+        # Admission happens before the choice is opened, so over quota is returned as a plain 429
+        tenant_id = TenantScheduler.tenant_id(request, TENANT_HEADER)
+        async with self.scheduler.slot(tenant_id):
+            try:
+                with response.create_single_choice() as choice:
+                    logger.debug(f"Created response choice [conversation_id={conversation_id}]")
+
+                    usage_tracker = UsageTracker()
+                    coordinator = MASCoordinator(
+                        endpoint=DIAL_ENDPOINT,
+                        deployment_name=DEPLOYMENT_NAME,
+                        ums_agent_endpoint=UMS_AGENT_ENDPOINT,
+                        response_cache=self.response_cache,
+                        context_compactor=self.context_compactor,
+                        speculative_agents=SPECULATIVE_AGENTS,
+                        usage_tracker=usage_tracker,
+                        caller_id=tenant_id,
+                    )
+                    async with profile_request(
+                            request=request,
+                            enabled=PROFILING_ENABLED,
+                            header=PROFILING_HEADER,
+                            output_dir=PROFILING_OUTPUT_DIR
+                    ):
+                        await self.coalescer.run(
+                            key=RequestCoalescer.request_key(request, tenant_id) if REQUEST_COALESCING_ENABLED else None,
+                            choice=choice,
+                            producer=lambda target: coordinator.handle_request(choice=target, request=request),
+                        )
+                    usage_tracker.report(response)
+
+                    logger.info(f"Successfully completed chat request [conversation_id={conversation_id}]")
+
+            except Exception as e:
+                logger.error(
+                    f"Error processing chat completion [conversation_id={conversation_id}]: {str(e)}",
+                    exc_info=True
                 )
+                raise
 
-                logger.info(f"Successfully completed chat request [conversation_id={conversation_id}]")
 
-        except Exception as e:
-            logger.error(
-                f"Error processing chat completion [conversation_id={conversation_id}]: {str(e)}",
-                exc_info=True
-            )
-            raise
+loop_lag_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL, slow_threshold=LOOP_LAG_SLOW_THRESHOLD)
+
+
+async def warm_up() -> None:
+    # 1. Load client libraries off the event loop, the port is already accepting connections
+    started = time.perf_counter()
+    await asyncio.to_thread(pools.preload)
+    logger.info(f"Client libraries preloaded in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    # 2. Open keep-alive connections to downstream services, the worker stays not ready until both answer
+    delay = WARM_UP_RETRY_DELAY
+    while not await pools.warm_up(dial_endpoint=DIAL_ENDPOINT, ums_agent_endpoint=UMS_AGENT_ENDPOINT):
+        logger.warning(f"Downstream services unreachable, worker is not ready, retrying in {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX_DELAY)
+    server_state.warmed_up = True
+    logger.info("Downstream connections warmed up, worker is ready")
+
+
+@asynccontextmanager
+async def lifespan(_app: DIALApp):
+    server_state.install_drain_handler()
+    if LOOP_LAG_MONITOR_ENABLED:
+        await loop_lag_monitor.start()
+
+    # Warm up in background, port is bound only after the startup completes
+    warm_up_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await loop_lag_monitor.stop()
+        await pools.close()
+
+
+async def readiness() -> JSONResponse:
+    return JSONResponse(
+        status_code=200 if server_state.ready else 503,
+        content={"ready": server_state.ready, "warmed_up": server_state.warmed_up, "draining": server_state.draining},
+    )
 
 
 logger.info("Creating DIAL application")
-app: DIALApp = DIALApp()
+app: DIALApp = DIALApp(lifespan=lifespan)
 agent_app = MASCoordinatorApplication()
 app.add_chat_completion(deployment_name="mas-coordinator", impl=agent_app)
+app.add_api_route("/metrics", lambda: metrics.snapshot(), methods=["GET"])
+app.add_api_route("/ready", readiness, methods=["GET"])
 logger.info("DIAL application initialized successfully")
 
 
 if __name__ == "__main__":
     import sys
 
+    import uvicorn
+
     if 'pydevd' in sys.modules:
         logger.info("Running in debug mode")
-        config = uvicorn.Config(app, port=8055, host="0.0.0.0", log_level="info")
+        config = uvicorn.Config(app, port=PORT, host=HOST, log_level="info")
         server = uvicorn.Server(config)
-        import asyncio
         asyncio.run(server.serve())
+    elif SERVER_MODE == 'production':
+        run_production()
     else:
-        logger.info("Starting uvicorn server on 0.0.0.0:8055")
-        uvicorn.run(app, port=8055, host="0.0.0.0", log_level="info")
+        logger.info(f"Starting uvicorn server on {HOST}:{PORT}")
+        uvicorn.run(app, port=PORT, host=HOST, log_level="info")
 
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Optional
+
+from aidial_sdk.chat_completion import Choice, Request
+from aidial_sdk.chat_completion.chunks import BaseChunk
+from aidial_sdk.exceptions import HTTPException as DIALException
+
+from task.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Flight:
+    """
+    Pipeline run shared by identical requests, its chunks are fanned out to every subscribed request.
+
+    The pipeline runs in a task owned by the flight and writes to a detached choice, so it outlives any
+    single subscriber, including the request that started it.
+    """
+
+    def __init__(self, choice_index: int):
+        self.chunks: list[BaseChunk] = []
+        self.subscribers = 0
+        self.followers = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+        # Subscribers open and close their own choices, the flight choice only produces content chunks
+        self.choice = Choice(_FlightQueue(self), choice_index)
+        self.choice._opened = True
+
+    def publish(self, chunk: BaseChunk) -> None:
+        self.chunks.append(chunk)
+        self.__notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self.__notify()
+
+    async def follow(self, choice: Choice) -> None:
+        # Replay everything the flight has produced so far, then wait for the rest
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                choice.send_chunk(self.chunks[position])
+                position += 1
+
+            if self.done:
+                break
+
+            await self._updated.wait()
+
+        if isinstance(self.error, Exception):
+            raise self.error
+        if self.error is not None:
+            raise DIALException(
+                message="Coalesced request was cancelled before completion",
+                status_code=503,
+            )
+
+    def __notify(self) -> None:
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+
+class _FlightQueue:
+    """Chunk queue of the flight choice, publishing chunks to all subscribers"""
+
+    def __init__(self, flight: _Flight):
+        self._flight = flight
+
+    def put_nowait(self, chunk: Any) -> None:
+        if isinstance(chunk, BaseChunk):
+            self._flight.publish(chunk)
+
+
+class RequestCoalescer:
+    """
+    Singleflight for identical concurrent chat completion requests.
+
+    The first request for a key starts a flight running the pipeline in the background, every identical request
+    that arrives while it is in flight attaches to it and receives the same chunks on its own choice. The flight
+    is cancelled only once every attached request has gone away.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+
+    @staticmethod
+    def request_key(request: Request, caller_id: str) -> Optional[str]:
+        """
+        Build coalescing key from caller identity, conversation ID and message history hash.
+
+        Flights are shared only by requests of the same caller: output produced with one caller's credentials is
+        never streamed to another caller that happens to send the same conversation ID and history.
+        """
+        conversation_id = request.headers.get('x-conversation-id')
+        if not conversation_id:
+            return None
+
+        history = json.dumps(
+            [msg.dict(exclude_none=True) for msg in request.messages],
+            sort_keys=True,
+            default=str,
+        )
+        history_hash = hashlib.sha256(history.encode('utf-8')).hexdigest()
+        return f"{caller_id}:{conversation_id}:{history_hash}"
+
+    async def run(
+            self,
+            key: Optional[str],
+            choice: Choice,
+            producer: Callable[[Choice], Awaitable[Any]]
+    ) -> None:
+        if key is None:
+            await producer(choice)
+            return
+
+        # 1. Attach to the flight if identical request is already in flight, otherwise start a new one
+        follower = key in self._flights
+        if follower:
+            flight = self._flights[key]
+            flight.followers += 1
+            logger.info(f"Attached to in-flight request [key={key}, followers={flight.followers}]")
+        else:
+            flight = self._flights[key] = _Flight(choice.index)
+            flight.task = asyncio.create_task(self.__fly(key, flight, producer))
+
+        # 2. Stream flight chunks to this request's choice
+        flight.subscribers += 1
+        try:
+            await flight.follow(choice)
+        except asyncio.CancelledError:
+            if follower:
+                flight.followers -= 1
+            raise
+        finally:
+            flight.subscribers -= 1
+            # 3. Nobody is waiting for the result anymore, stop the pipeline
+            if not flight.subscribers and not flight.done:
+                self.__release(key, flight)
+                flight.task.cancel()
+
+    async def __fly(self, key: str, flight: _Flight, producer: Callable[[Choice], Awaitable[Any]]) -> None:
+        try:
+            await producer(flight.choice)
+        except BaseException as e:
+            flight.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            flight.finish()
+        finally:
+            self.__release(key, flight)
+            if flight.followers:
+                logger.info(f"Coalesced request completed [key={key}, followers={flight.followers}]")
+
+    def __release(self, key: str, flight: _Flight) -> None:
+        # Next identical request starts a new flight
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,197 @@
+import asyncio
+import math
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = get_logger(__name__)
+
+RATIO_BUCKETS: tuple[float, ...] = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_TABLE_ROW = re.compile(r"^\s*\|.*\|\s*$")
+_RECORD_FIELD = re.compile(r"^\s*(?:[-*]\s+)?\**[\w .()/-]{1,40}\**\s*:\s*\S")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[])")
+_WORD = re.compile(r"\w+", re.UNICODE)
+_TRUNCATED = "\n[... truncated ...]"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding("o200k_base") if tiktoken else None
+
+
+def count_tokens(text: str) -> int:
+    if encoding := _encoding():
+        return len(encoding.encode(text, disallowed_special=()))
+    # ~4 characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+@dataclass
+class _Block:
+    text: str
+    protected: bool
+
+
+@dataclass
+class CompactionResult:
+    content: str
+    original_tokens: int
+    compacted_tokens: int
+    duration: float
+
+    @property
+    def ratio(self) -> float:
+        return self.compacted_tokens / self.original_tokens if self.original_tokens else 1.0
+
+
+def split_blocks(text: str) -> list[_Block]:
+    """Split markdown into protected (code blocks, tables, records) and prose blocks"""
+    blocks: list[_Block] = []
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        # Fenced code block, kept up to the closing fence (or end of text)
+        if fence := _FENCE.match(line):
+            j = i + 1
+            while j < len(lines) and not lines[j].lstrip().startswith(fence.group(1)):
+                j += 1
+            blocks.append(_Block("\n".join(lines[i:j + 1]), protected=True))
+            i = j + 1
+            continue
+
+        # Markdown table
+        if _TABLE_ROW.match(line):
+            j = i
+            while j < len(lines) and _TABLE_ROW.match(lines[j]):
+                j += 1
+            blocks.append(_Block("\n".join(lines[i:j]), protected=True))
+            i = j
+            continue
+
+        # Paragraph, protected when it looks like a record ("Name: ...", "- **Email**: ...")
+        j = i
+        while j < len(lines) and lines[j].strip() and not _FENCE.match(lines[j]) and not _TABLE_ROW.match(lines[j]):
+            j += 1
+        if j == i:
+            blocks.append(_Block(line, protected=False))
+            i += 1
+            continue
+        paragraph = lines[i:j]
+        record_fields = sum(1 for p in paragraph if _RECORD_FIELD.match(p))
+        blocks.append(_Block("\n".join(paragraph), protected=record_fields >= 2))
+        i = j
+
+    return blocks
+
+
+class ContextCompactor:
+    """
+    Reduces agent output to a token budget before final synthesis.
+
+    Code blocks, tables and record-like paragraphs are kept verbatim, the rest of the text is reduced
+    extractively: sentences are scored by relevance to the user request and by term centrality, and the
+    best ones are kept in their original order.
+    """
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+
+    async def compact(self, content: str, query: Callable[[], str]) -> CompactionResult:
+        """`query` is evaluated only when the content is over budget"""
+        started = time.perf_counter()
+        original_tokens = count_tokens(content)
+        if original_tokens <= self.token_budget:
+            return CompactionResult(content, original_tokens, original_tokens, time.perf_counter() - started)
+
+        # Large outputs are compacted off the event loop
+        compacted = await asyncio.to_thread(self._compact, content, query())
+        result = CompactionResult(
+            content=compacted,
+            original_tokens=original_tokens,
+            compacted_tokens=count_tokens(compacted),
+            duration=time.perf_counter() - started,
+        )
+
+        metrics.inc("context_compactions_total")
+        metrics.observe("context_compaction_ratio", result.ratio, buckets=RATIO_BUCKETS)
+        metrics.observe("context_compaction_seconds", result.duration)
+        logger.info(
+            f"Compacted agent context {result.original_tokens} -> {result.compacted_tokens} tokens "
+            f"[ratio={result.ratio:.2f}, duration={result.duration * 1000:.1f}ms]"
+        )
+        return result
+
+    def _compact(self, content: str, query: str) -> str:
+        blocks = split_blocks(content)
+        protected_tokens = sum(count_tokens(b.text) for b in blocks if b.protected)
+        prose_budget = self.token_budget - protected_tokens
+
+        # 1. Collect prose sentences with their block position
+        sentences: list[tuple[int, int, str]] = []
+        for block_idx, block in enumerate(blocks):
+            if not block.protected and block.text.strip():
+                for sentence_idx, sentence in enumerate(_SENTENCE_SPLIT.split(block.text.strip())):
+                    sentences.append((block_idx, sentence_idx, sentence))
+
+        # 2. Select best sentences within the remaining budget
+        selected: set[tuple[int, int]] = set()
+        if prose_budget > 0 and sentences:
+            query_terms = set(_WORD.findall(query.lower()))
+            term_frequency = Counter(w for _, _, s in sentences for w in _WORD.findall(s.lower()))
+
+            def score(item: tuple[int, int, str]) -> float:
+                block_idx, sentence_idx, sentence = item
+                words = _WORD.findall(sentence.lower())
+                if not words:
+                    return 0.0
+                relevance = sum(1 for w in set(words) if w in query_terms)
+                centrality = sum(math.log1p(term_frequency[w]) for w in set(words)) / len(words)
+                leading = 1.0 if sentence_idx == 0 else 0.0
+                return 2.0 * relevance + centrality + leading
+
+            used = 0
+            for block_idx, sentence_idx, sentence in sorted(sentences, key=score, reverse=True):
+                tokens = count_tokens(sentence) + 1
+                if used + tokens > prose_budget:
+                    continue
+                selected.add((block_idx, sentence_idx))
+                used += tokens
+
+        # 3. Rebuild text in original order
+        sentences_by_block: dict[int, list[tuple[int, str]]] = {}
+        for block_idx, sentence_idx, sentence in sentences:
+            sentences_by_block.setdefault(block_idx, []).append((sentence_idx, sentence))
+
+        parts: list[str] = []
+        for block_idx, block in enumerate(blocks):
+            if block.protected:
+                parts.append(block.text)
+            elif kept := [s for i, s in sentences_by_block.get(block_idx, []) if (block_idx, i) in selected]:
+                parts.append(" ".join(kept))
+        compacted = "\n\n".join(parts)
+
+        # 4. Protected blocks alone may exceed the budget, hard limit as last resort
+        if count_tokens(compacted) > self.token_budget:
+            compacted = self.__truncate(compacted)
+
+        return compacted
+
+    def __truncate(self, text: str) -> str:
+        if encoding := _encoding():
+            return encoding.decode(encoding.encode(text, disallowed_special=())[:self.token_budget]) + _TRUNCATED
+        return text[:self.token_budget * 4] + _TRUNCATED
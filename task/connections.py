@@ -0,0 +1,142 @@
+import asyncio
+import importlib
+import os
+from typing import Optional, TYPE_CHECKING
+
+from task.logging_config import get_logger
+
+if TYPE_CHECKING:
+    import httpx
+    from aidial_client import AsyncDial, AsyncDialClientPool
+
+logger = get_logger(__name__)
+
+DIAL_API_VERSION = '2025-01-01-preview'
+
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '200'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('MAX_KEEPALIVE_CONNECTIONS', '50'))
+KEEPALIVE_EXPIRY = float(os.getenv('KEEPALIVE_EXPIRY', '30'))
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'
+HTTP2_MAX_STREAMS_PER_CONNECTION = int(os.getenv('HTTP2_MAX_STREAMS_PER_CONNECTION', '100'))
+
+# HTTP and DIAL client libraries take about half of the application import time, they are loaded on first use
+# or preloaded by the startup warm-up
+_LAZY_MODULES = (
+    "httpx",
+    "task.transport",
+    "aidial_client",
+    "aidial_client.types.chat.response",
+)
+
+
+class ConnectionPools:
+    """
+    Per-worker HTTP connection pools for DIAL Core and UMS Agent.
+
+    Clients are created lazily inside the worker process, so every worker owns its own pools and keeps
+    connections alive between requests instead of opening new ones for each call. With HTTP2_ENABLED
+    concurrent streams are multiplexed over a few HTTP/2 connections per service.
+    """
+
+    def __init__(self):
+        self._dial_http_client: Optional["httpx.AsyncClient"] = None
+        self._dial_client_pool: Optional["AsyncDialClientPool"] = None
+        self._ums_http_client: Optional["httpx.AsyncClient"] = None
+
+    @staticmethod
+    def preload() -> None:
+        """Import client libraries ahead of the first request, blocking, meant to run in a thread"""
+        for module in _LAZY_MODULES:
+            importlib.import_module(module)
+
+    @staticmethod
+    def __limits() -> "httpx.Limits":
+        import httpx
+
+        return httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+
+    @staticmethod
+    def __create_transport(name: str) -> "httpx.AsyncBaseTransport":
+        from task.transport import create_transport
+
+        return create_transport(
+            name=name,
+            limits=ConnectionPools.__limits(),
+            http2=HTTP2_ENABLED,
+            max_streams_per_connection=HTTP2_MAX_STREAMS_PER_CONNECTION,
+        )
+
+    def __create_dial_pools(self) -> None:
+        import httpx
+        from aidial_client import AsyncDialClientPool
+
+        # DIAL clients and the warm-up client share one transport, so warmed up connections serve DIAL calls
+        transport = self.__create_transport("dial")
+        self._dial_http_client = httpx.AsyncClient(transport=transport)
+        self._dial_client_pool = AsyncDialClientPool(connection_limits=self.__limits(), transport=transport)
+
+    @property
+    def dial_http_client(self) -> "httpx.AsyncClient":
+        if self._dial_http_client is None:
+            self.__create_dial_pools()
+        return self._dial_http_client
+
+    @property
+    def ums_http_client(self) -> "httpx.AsyncClient":
+        if self._ums_http_client is None:
+            import httpx
+
+            self._ums_http_client = httpx.AsyncClient(transport=self.__create_transport("ums"))
+        return self._ums_http_client
+
+    def create_dial_client(self, base_url: str, api_key: str) -> "AsyncDial":
+        """
+        Create per-request AsyncDial client with request API key on top of the shared pool.
+        Pooled clients have no default API version, calls pass DIAL_API_VERSION explicitly.
+        """
+        if self._dial_client_pool is None:
+            self.__create_dial_pools()
+        return self._dial_client_pool.create_client(base_url=base_url, api_key=api_key)
+
+    async def warm_up(self, dial_endpoint: str, ums_agent_endpoint: str, attempts: int = 5) -> bool:
+        """
+        Open keep-alive connections to downstream services before the worker reports readiness.
+        Returns whether both services answered.
+        """
+        results = await asyncio.gather(
+            self.__warm_up(self.dial_http_client, f"{dial_endpoint}/health", attempts),
+            self.__warm_up(self.ums_http_client, f"{ums_agent_endpoint}/health", attempts),
+        )
+        return all(results)
+
+    @staticmethod
+    async def __warm_up(client: "httpx.AsyncClient", url: str, attempts: int) -> bool:
+        import httpx
+
+        for attempt in range(1, attempts + 1):
+            try:
+                # Any HTTP response means the connection is established and kept in the pool
+                response = await client.get(url, timeout=5.0)
+                logger.info(f"Warmed up connection to {url} [status={response.status_code}]")
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Unable to warm up connection to {url} (attempt {attempt}/{attempts}): {e}")
+                if attempt < attempts:
+                    await asyncio.sleep(min(2 ** attempt, 10))
+        return False
+
+    async def close(self) -> None:
+        # Closing the warm-up client closes the transport shared with the DIAL client pool
+        for client in (self._dial_http_client, self._ums_http_client):
+            if client is not None:
+                await client.aclose()
+        self._dial_http_client = None
+        self._dial_client_pool = None
+        self._ums_http_client = None
+
+
+pools = ConnectionPools()
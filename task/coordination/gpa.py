@@ -1,20 +1,45 @@
 from copy import deepcopy
-from typing import Optional, Any
+from typing import Optional, Any, TYPE_CHECKING
 
-from aidial_client import AsyncDial
-from aidial_sdk.chat_completion import Role, Choice, Request, Message, CustomContent, Stage, Attachment
+from aidial_sdk.chat_completion import Role, Choice, Request, Message, CustomContent, Stage
 from pydantic import StrictStr
 
-from task.stage_util import StageProcessor
+from task.connections import DIAL_API_VERSION, pools
+from task.coordination.multiplexer import StreamMultiplexer
+from task.streaming import StreamPipeline
+from task.usage import UsageTracker
+
+if TYPE_CHECKING:
+    from aidial_client import AsyncDial
+    from aidial_client.types.chat.response import ChatCompletionChunk
 
 _IS_GPA = "is_gpa"
 _GPA_MESSAGES = "gpa_messages"
+_GPA_DEPLOYMENT_NAME = "general-purpose-agent"
+
+
+def _coalesce_chunks(last: "ChatCompletionChunk", chunk: "ChatCompletionChunk") -> Optional["ChatCompletionChunk"]:
+    """Merge two plain content chunks, anything carrying attachments, stages, state or usage is kept as is"""
+    if last.usage or chunk.usage or len(last.choices) != 1 or len(chunk.choices) != 1:
+        return None
+    last_choice, choice = last.choices[0], chunk.choices[0]
+    if last_choice.finish_reason or choice.finish_reason:
+        return None
+    if last_choice.delta.model_dump(exclude_none=True).keys() != {"content"}:
+        return None
+    if choice.delta.model_dump(exclude_none=True).keys() != {"content"}:
+        return None
+
+    # Buffered chunk belongs to the pipeline, growing it in place avoids copying it on every merge
+    last_choice.delta.content += choice.delta.content
+    return last
 
 
 class GPAGateway:
 
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, usage_tracker: Optional[UsageTracker] = None):
         self.endpoint = endpoint
+        self.usage_tracker = usage_tracker
 
     async def response(
             self,
@@ -23,94 +48,57 @@ class GPAGateway:
             request: Request,
             additional_instructions: Optional[str]
     ) -> Message:
-        # 1. Create AsyncDial client
-        api_key = request.api_key
-        client: AsyncDial = AsyncDial(
-            base_url=self.endpoint,
-            api_key=api_key,
-            api_version='2025-01-01-preview'
-        )
+        # 1. Create AsyncDial client on top of the worker connection pool
+        client: "AsyncDial" = pools.create_dial_client(base_url=self.endpoint, api_key=request.api_key)
 
         # 2. Make call with streaming
+        started = UsageTracker.start()
         chunks = await client.chat.completions.create(
             stream=True,
             messages=self.__prepare_gpa_messages(request, additional_instructions),
-            deployment_name="general-purpose-agent",
+            deployment_name=_GPA_DEPLOYMENT_NAME,
+            api_version=DIAL_API_VERSION,
             extra_headers={
                 'x-conversation-id': request.headers.get('x-conversation-id'),
             }
         )
 
-        # 3. Create variables for collecting response data
-        content = ''
-        result_custom_content: CustomContent = CustomContent(attachments=[])
-        stages_map: dict[int, Stage] = {}
-        
-        # 4. Process streaming chunks
-        async for chunk in chunks:
-            if chunk.choices and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                
-                # Print delta for debugging
-                if delta:
-                    print(delta)
-                
-                # Append content to stage
-                if delta and delta.content:
-                    stage.append_content(delta.content)
-                    content += delta.content
-                
-                # Handle custom_content (attachments, state, stages)
-                if cc := delta.custom_content:
-                    # Handle attachments
-                    if cc.attachments:
-                        result_custom_content.attachments.extend(cc.attachments)
-
-                    # Handle state
-                    if cc.state:
-                        result_custom_content.state = cc.state
-
-                    # Propagate stages from GPA
-                    cc_dict = cc.dict(exclude_none=True)
-                    if stages := cc_dict.get("stages"):
-                        for stg in stages:
-                            idx = stg["index"]
-                            
-                            # If stage already exists, update it
-                            if opened_stg := stages_map.get(idx):
-                                if stg_content := stg.get("content"):
-                                    opened_stg.append_content(stg_content)
-                                elif stg_attachments := stg.get("attachments"):
-                                    for stg_attachment in stg_attachments:
-                                        opened_stg.add_attachment(Attachment(**stg_attachment))
-                                elif stg.get("status") and stg.get("status") == 'completed':
-                                    StageProcessor.close_stage_safely(stages_map[idx])
-                            else:
-                                # Open new stage and add to map
-                                stages_map[idx] = StageProcessor.open_stage(choice, stg.get("name"))
-
-        # Close any remaining open stages
-        for stg in stages_map.values():
-            StageProcessor.close_stage_safely(stg)
-
-        # 5. Propagate result_custom_content to choice
-        for attachment in result_custom_content.attachments:
-            choice.add_attachment(
-                Attachment(**attachment.dict(exclude_none=True))
-            )
-
-        # 6. Save GPA conversation info to state
-        choice.set_state(
-            {
-                _IS_GPA: True,
-                _GPA_MESSAGES: result_custom_content.state,
-            }
-        )
-
-        # 7. Return assistant message
+        from aidial_client.types.chat.response import ChatCompletionChunk
+
+        # 3. Read GPA stream into a bounded buffer, forward content, attachments and stages to the choice
+        multiplexer = StreamMultiplexer(choice=choice, stage=stage)
+        usage = None
+        async with StreamPipeline(
+                name="gpa",
+                upstream=chunks,
+                downstream_queue=choice._queue,
+                coalesce=_coalesce_chunks,
+                dumps=lambda chunk: chunk.model_dump_json(),
+                loads=ChatCompletionChunk.model_validate_json,
+        ) as pipeline:
+            async for chunk in pipeline:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and len(chunk.choices) > 0:
+                    multiplexer.process(chunk.choices[0].delta)
+
+        # 4. Close any remaining open stages
+        multiplexer.close()
+        if self.usage_tracker:
+            self.usage_tracker.record("gpa", _GPA_DEPLOYMENT_NAME, usage, started)
+
+        # 5. Save GPA conversation info to state
+        state = {
+            _IS_GPA: True,
+            _GPA_MESSAGES: multiplexer.state,
+        }
+        choice.set_state(state)
+
+        # 6. Return assistant message with propagated attachments and state
         return Message(
             role=Role.ASSISTANT,
-            content=StrictStr(content),
+            content=StrictStr(multiplexer.content),
+            custom_content=CustomContent(attachments=multiplexer.attachments, state=state),
         )
 
     def __prepare_gpa_messages(self, request: Request, additional_instructions: Optional[str]) -> list[dict[str, Any]]:
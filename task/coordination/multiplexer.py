@@ -0,0 +1,85 @@
+from typing import Any, Optional
+
+from aidial_sdk.chat_completion import Choice, Stage, Attachment, Status
+
+from task.stage_util import StageProcessor
+
+
+def to_attachment(attachment: Any) -> Attachment:
+    """Convert downstream (aidial_client) attachment to SDK attachment field by field"""
+    return Attachment(
+        type=attachment.type or "text/markdown",
+        title=attachment.title,
+        data=attachment.data,
+        url=attachment.url,
+        reference_type=attachment.reference_type,
+        reference_url=attachment.reference_url,
+    )
+
+
+class StreamMultiplexer:
+    """
+    Forwards a downstream DIAL agent stream to the choice in a single pass per chunk.
+
+    Content goes to the agent stage, attachments are added to the choice as soon as they arrive
+    (deduplicated by URL), and propagated stages are opened, updated and closed in place.
+    """
+
+    def __init__(self, choice: Choice, stage: Stage):
+        self.choice = choice
+        self.stage = stage
+        self.attachments: list[Attachment] = []
+        self.state: Optional[Any] = None
+        self._content: list[str] = []
+        self._attachment_keys: set[Any] = set()
+        self._stages: dict[int, Stage] = {}
+
+    @property
+    def content(self) -> str:
+        return ''.join(self._content)
+
+    def process(self, delta: Any) -> None:
+        if delta.content:
+            self.stage.append_content(delta.content)
+            self._content.append(delta.content)
+
+        if not (cc := delta.custom_content):
+            return
+
+        for attachment in cc.attachments or []:
+            self.__add_attachment(attachment)
+
+        if cc.state is not None:
+            self.state = cc.state
+
+        # Stages are not part of the client CustomContent model and arrive as plain dicts
+        for stg in getattr(cc, "stages", None) or []:
+            self.__process_stage(stg)
+
+    def close(self) -> None:
+        for stg in self._stages.values():
+            StageProcessor.close_stage_safely(stg)
+
+    def __add_attachment(self, attachment: Any) -> None:
+        key = attachment.url or (attachment.title, attachment.data)
+        if key in self._attachment_keys:
+            return
+        self._attachment_keys.add(key)
+
+        sdk_attachment = to_attachment(attachment)
+        self.choice.add_attachment(sdk_attachment)
+        self.attachments.append(sdk_attachment)
+
+    def __process_stage(self, stg: dict[str, Any]) -> None:
+        idx = stg["index"]
+        if (opened_stg := self._stages.get(idx)) is None:
+            opened_stg = self._stages[idx] = StageProcessor.open_stage(self.choice, stg.get("name"))
+
+        if stg_content := stg.get("content"):
+            opened_stg.append_content(stg_content)
+
+        for stg_attachment in stg.get("attachments") or []:
+            opened_stg.add_attachment(Attachment(**stg_attachment))
+
+        if status := stg.get("status"):
+            StageProcessor.close_stage_safely(opened_stg, Status(status))
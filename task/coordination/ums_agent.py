@@ -1,18 +1,32 @@
 import json
-from typing import Optional
+from typing import Any, AsyncIterator, Optional, TYPE_CHECKING
 
-import httpx
 from aidial_sdk.chat_completion import Role, Request, Message, Stage, Choice
 from pydantic import StrictStr
 
+from task.connections import pools
+from task.streaming import StreamPipeline
+from task.usage import UsageTracker
+
+if TYPE_CHECKING:
+    import httpx
+
 
 _UMS_CONVERSATION_ID = "ums_conversation_id"
+_UMS_AGENT_NAME = "ums-agent"
+
+
+def _coalesce_events(last: dict[str, Any], event: dict[str, Any]) -> Optional[dict[str, Any]]:
+    if last.keys() == event.keys() == {'content'}:
+        return {'content': last['content'] + event['content']}
+    return None
 
 
 class UMSAgentGateway:
 
-    def __init__(self, ums_agent_endpoint: str):
+    def __init__(self, ums_agent_endpoint: str, usage_tracker: Optional[UsageTracker] = None):
         self.ums_agent_endpoint = ums_agent_endpoint
+        self.usage_tracker = usage_tracker
 
     async def response(
             self,
@@ -63,19 +77,17 @@ class UMSAgentGateway:
 
     async def __create_ums_conversation(self) -> str:
         """Create a new conversation on UMS agent side"""
-        # 1. Create async context manager
-        async with httpx.AsyncClient() as client:
-            # 2. Make POST request to create conversation
-            response = await client.post(
-                f"{self.ums_agent_endpoint}/conversations",
-                json={"title": "UMS Agent Conversation"},
-                timeout=30.0
-            )
-            response.raise_for_status()
-            
-            # 3. Get response json and return id
-            conversation_data = response.json()
-            return conversation_data['id']
+        # 1. Make POST request to create conversation through the worker connection pool
+        response = await pools.ums_http_client.post(
+            f"{self.ums_agent_endpoint}/conversations",
+            json={"title": "UMS Agent Conversation"},
+            timeout=30.0
+        )
+        response.raise_for_status()
+
+        # 2. Get response json and return id
+        conversation_data = response.json()
+        return conversation_data['id']
 
     async def __call_ums_agent(
             self,
@@ -84,10 +96,10 @@ class UMSAgentGateway:
             stage: Stage
     ) -> str:
         """Call UMS agent and stream the response"""
-        # 1. Create async context manager
-        async with httpx.AsyncClient() as client:
-            # 2. Make POST request to chat with streaming enabled
-            response = await client.post(
+        # 1. Open streaming POST request to chat through the worker connection pool
+        started = UsageTracker.start()
+        async with pools.ums_http_client.stream(
+                "POST",
                 f"{self.ums_agent_endpoint}/conversations/{conversation_id}/chat",
                 json={
                     "message": {
@@ -97,34 +109,59 @@ class UMSAgentGateway:
                     "stream": True
                 },
                 timeout=60.0
-            )
+        ) as response:
             response.raise_for_status()
 
-            # 3. Parse streaming response
+            # 2. Read SSE events into a bounded buffer, append chunks to stage and accumulate
             content = ''
-            async for line in response.aiter_lines():
-                if line.startswith('data: '):
-                    data_str = line[6:]  # Cut the 'data: ' prefix
-
-                    # Check for end of stream
-                    if data_str == '[DONE]':
-                        break
-
-                    try:
-                        data = json.loads(data_str)
-
-                        # Skip conversation_id message
-                        if 'conversation_id' in data:
-                            continue
-
-                        # Extract content from choices
-                        if 'choices' in data and len(data['choices']) > 0:
-                            delta = data['choices'][0].get('delta', {})
-                            if delta_content := delta.get('content'):
-                                # Append chunks to stage and accumulate
-                                stage.append_content(delta_content)
-                                content += delta_content
-                    except json.JSONDecodeError:
-                        continue
-
-            return content
+            usage = None
+            async with StreamPipeline(
+                    name="ums",
+                    upstream=self.__read_events(response),
+                    downstream_queue=stage._queue,
+                    coalesce=_coalesce_events,
+                    dumps=json.dumps,
+                    loads=json.loads,
+            ) as pipeline:
+                async for event in pipeline:
+                    if event.get('usage'):
+                        usage = event['usage']
+                    if delta_content := event.get('content'):
+                        stage.append_content(delta_content)
+                        content += delta_content
+
+        if self.usage_tracker:
+            self.usage_tracker.record("ums", _UMS_AGENT_NAME, usage, started)
+
+        return content
+
+    @staticmethod
+    async def __read_events(response: "httpx.Response") -> AsyncIterator[dict[str, Any]]:
+        """Parse UMS SSE stream into content and usage events"""
+        async for line in response.aiter_lines():
+            if not line.startswith('data: '):
+                continue
+
+            data_str = line[6:]  # Cut the 'data: ' prefix
+
+            # Check for end of stream
+            if data_str == '[DONE]':
+                break
+
+            try:
+                data = json.loads(data_str)
+            except json.JSONDecodeError:
+                continue
+
+            # Skip conversation_id message
+            if 'conversation_id' in data:
+                continue
+
+            if data.get('usage'):
+                yield {'usage': data['usage']}
+
+            # Extract content from choices
+            if 'choices' in data and len(data['choices']) > 0:
+                delta = data['choices'][0].get('delta', {})
+                if delta_content := delta.get('content'):
+                    yield {'content': delta_content}
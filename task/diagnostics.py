@@ -0,0 +1,153 @@
+import asyncio
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aidial_sdk.chat_completion import Request
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+logger = get_logger(__name__)
+
+LOOP_LAG_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_profiling_active = False
+
+
+class LoopLagMonitor:
+    """
+    Samples event loop scheduling delay and reports it to the `event_loop_lag_seconds` histogram.
+
+    A watchdog thread dumps the loop thread stack trace when the loop has not ticked for longer than
+    `slow_threshold`, which points at the synchronous code that is starving the loop.
+    """
+
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.25):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+
+    async def start(self) -> None:
+        if self._task:
+            return
+        self._stopped.clear()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = asyncio.create_task(self.__sample())
+        self._watchdog = threading.Thread(target=self.__watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started [interval={self.interval}s, slow_threshold={self.slow_threshold}s]")
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def __sample(self) -> None:
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_tick = time.monotonic()
+            lag = max(0.0, self._last_tick - scheduled - self.interval)
+            metrics.observe("event_loop_lag_seconds", lag, buckets=LOOP_LAG_BUCKETS)
+            if lag >= self.slow_threshold:
+                logger.warning(f"Event loop lag {lag * 1000:.1f}ms")
+
+    def __watch(self) -> None:
+        reported_tick = None
+        while not self._stopped.wait(self.slow_threshold / 2):
+            last_tick = self._last_tick
+            blocked_for = time.monotonic() - last_tick - self.interval
+            if blocked_for < self.slow_threshold or reported_tick == last_tick:
+                continue
+
+            # Report every stall once, stack is captured while the loop is still blocked
+            reported_tick = last_tick
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<unavailable>"
+            metrics.inc("event_loop_stalls_total")
+            logger.warning(f"Event loop blocked for {blocked_for * 1000:.1f}ms, loop thread stack:\n{stack}")
+
+
+@asynccontextmanager
+async def profile_request(request: Request, enabled: bool, header: str, output_dir: str) -> AsyncIterator[None]:
+    """Profile a single request when profiling is enabled and the request carries the profiling header"""
+    if not enabled or request.headers.get(header, '').lower() not in ('1', 'true'):
+        yield
+        return
+
+    # Profilers hook the interpreter globally, so only one request is profiled at a time
+    global _profiling_active
+    if _profiling_active:
+        logger.warning("Profiling already in progress, request is not profiled")
+        yield
+        return
+
+    _profiling_active = True
+    try:
+        async with _profile(request, output_dir):
+            yield
+    finally:
+        _profiling_active = False
+
+
+@asynccontextmanager
+async def _profile(request: Request, output_dir: str) -> AsyncIterator[None]:
+    conversation_id = re.sub(r"[^\w.-]", "_", request.headers.get('x-conversation-id', 'unknown'))
+    path = os.path.join(output_dir, f"{int(time.time() * 1000)}-{conversation_id}")
+
+    if Profiler is not None:
+        # pyinstrument attributes awaited time to the awaiting coroutine, not to other requests on the loop
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path += ".html"
+            # Rendering a large profile takes longer than a typical request, it must not stall other requests
+            await asyncio.to_thread(_write_html, profiler, path)
+            logger.info(f"Saved request profile to {path}")
+    else:
+        # cProfile fallback is not async-aware, concurrently running requests are included
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path += ".prof"
+            await asyncio.to_thread(_dump_stats, profiler, path)
+            logger.info(f"Saved request profile to {path} (install pyinstrument for async-aware profiles)")
+
+
+def _write_html(profiler: "Profiler", path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(profiler.output_html())
+
+
+def _dump_stats(profiler: cProfile.Profile, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    profiler.dump_stats(path)
@@ -0,0 +1,82 @@
+import bisect
+from typing import Any
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> dict[str, Any]:
+        buckets = {f"le_{bound:g}": count for bound, count in zip(self.buckets, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "buckets": buckets,
+        }
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms, exposed as JSON by the app"""
+
+    def __init__(self):
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    @staticmethod
+    def key(name: str, **labels: Any) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = self.key(name, **labels)
+        self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        self.gauges[self.key(name, **labels)] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels: Any) -> None:
+        key = self.key(name, **labels)
+        if (histogram := self.histograms.get(key)) is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def get(self, name: str, **labels: Any) -> float:
+        """Current value of the counter or gauge series, 0 when it was never recorded"""
+        key = self.key(name, **labels)
+        return self.counters.get(key, self.gauges.get(key, 0.0))
+
+    def remove(self, name: str, **labels: Any) -> None:
+        """Drop every series of the metric whose labels include the given ones"""
+        wanted = {f"{k}={v}" for k, v in labels.items()}
+        for series in (self.counters, self.gauges, self.histograms):
+            for key in [key for key in series if key == name or key.startswith(name + "{")]:
+                if wanted <= set(key[len(name) + 1:-1].split(",")):
+                    del series[key]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {key: histogram.snapshot() for key, histogram in self.histograms.items()},
+        }
+
+
+metrics = MetricsRegistry()
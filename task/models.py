@@ -9,6 +9,11 @@ class AgentName(StrEnum):
     UMS = "UMS"
 
 
+class OperationType(StrEnum):
+    READ = "READ"
+    WRITE = "WRITE"
+
+
 class CoordinationRequest(BaseModel):
     agent_name: AgentName = Field(
         description=(
@@ -19,4 +24,12 @@ class CoordinationRequest(BaseModel):
     additional_instructions: Optional[str] = Field(
         default=None,
         description="**Optional**: Additional instructions to Agent."
-    )
\ No newline at end of file
+    )
+    operation_type: OperationType = Field(
+        default=OperationType.WRITE,
+        description=(
+            "Operation type. READ is used when the request is self-contained and only retrieves information "
+            "(answering questions, searching documents or users) without changing anything. "
+            "WRITE is used when the request creates, updates or deletes data, or depends on files or previous "
+            "conversation context.")
+    )
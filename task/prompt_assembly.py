@@ -0,0 +1,106 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Optional
+
+from aidial_sdk.chat_completion import Role, Request
+from pydantic import StrictStr
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+from task.models import CoordinationRequest
+from task.prompts import COORDINATION_REQUEST_SYSTEM_PROMPT, FINAL_RESPONSE_SYSTEM_PROMPT
+
+logger = get_logger(__name__)
+
+_MAX_TRACKED_PREFIXES = 4096
+
+
+def _message_to_dict(msg: Any) -> dict[str, Any]:
+    if msg.role == Role.USER and msg.custom_content:
+        # User message with custom content - skip custom content
+        return {"role": Role.USER, "content": StrictStr(msg.content)}
+    return msg.dict(exclude_none=True)
+
+
+def _prefix_digests(msgs: list[dict[str, Any]]) -> list[str]:
+    """Digest of every message prefix: digests[i] covers msgs[:i + 1]"""
+    digests = []
+    hasher = hashlib.sha256()
+    for msg in msgs:
+        hasher.update(json.dumps(msg, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        digests.append(hasher.copy().hexdigest())
+    return digests
+
+
+class PromptAssembler:
+    """
+    Builds LLM message lists with a byte-stable prefix.
+
+    System blocks and the structured output format are built once, history messages are converted once per
+    request and shared (never mutated) between routing and synthesis prompts. Per-turn data (agent context)
+    goes only to the last message, so the upstream prompt cache can reuse everything before it.
+    """
+
+    def __init__(self):
+        self.coordination_system = {"role": Role.SYSTEM, "content": COORDINATION_REQUEST_SYSTEM_PROMPT}
+        self.final_system = {"role": Role.SYSTEM, "content": FINAL_RESPONSE_SYSTEM_PROMPT}
+        self.coordination_response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "response",
+                "schema": CoordinationRequest.model_json_schema()
+            }
+        }
+        self._prefixes: OrderedDict[tuple[str, str], str] = OrderedDict()
+
+    @staticmethod
+    def history(request: Request) -> list[dict[str, Any]]:
+        return [_message_to_dict(msg) for msg in request.messages]
+
+    def coordination_messages(self, history: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        return [self.coordination_system, *history]
+
+    def final_messages(self, history: list[dict[str, Any]], context: str) -> list[dict[str, Any]]:
+        # Augmented copy of the last user message, history itself stays untouched
+        last_msg = history[-1]
+        return [
+            self.final_system,
+            *history[:-1],
+            {**last_msg, "content": f"## CONTEXT:\n {context}\n ---\n ## USER_REQUEST: \n {last_msg['content']}"},
+        ]
+
+    def track_prefix(
+            self,
+            conversation_id: Optional[str],
+            purpose: str,
+            msgs: list[dict[str, Any]],
+            dynamic_tail: int = 0
+    ) -> None:
+        """
+        Check that the cacheable prefix sent on the previous turn of the conversation is a byte-identical
+        prefix of this prompt, and remember this prompt's cacheable prefix for the next turn.
+        """
+        if not conversation_id:
+            return
+
+        digests = _prefix_digests(msgs)
+        key = (conversation_id, purpose)
+        if (previous := self._prefixes.get(key)) is not None:
+            stable = previous in digests
+            metrics.inc("prompt_prefix_checks_total", purpose=purpose, result="stable" if stable else "changed")
+            stable_checks = metrics.get("prompt_prefix_checks_total", purpose=purpose, result="stable")
+            changed_checks = metrics.get("prompt_prefix_checks_total", purpose=purpose, result="changed")
+            metrics.set("prompt_prefix_stability", stable_checks / (stable_checks + changed_checks), purpose=purpose)
+            if not stable:
+                logger.warning(f"Prompt prefix changed between turns [conversation_id={conversation_id}, purpose={purpose}]")
+
+        cacheable = len(msgs) - dynamic_tail
+        if cacheable > 0:
+            self._prefixes[key] = digests[cacheable - 1]
+            self._prefixes.move_to_end(key)
+            while len(self._prefixes) > _MAX_TRACKED_PREFIXES:
+                self._prefixes.popitem(last=False)
+
+
+prompt_assembler = PromptAssembler()
@@ -10,6 +10,7 @@ Your main task is to understand user intention and generate coordination request
 ## Instructions
 - Get the context of user intention
 - Identify proper Agent that will handle user request
+- Classify operation type: READ if the request only retrieves information and can be answered without previous conversation context, WRITE if it creates, updates or deletes data (e.g. users) or relies on attached files or earlier messages
 - **Optional:** Provide additional instructions (if needed) that will help the chosen agent to handle request better. Do not duplicate the original message, provide only in case if user message is confusing and not clear enough
 """
 
@@ -0,0 +1,157 @@
+import hashlib
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from task.logging_config import get_logger
+from task.models import AgentName
+
+logger = get_logger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+_EMBEDDING_DIMENSIONS = 1024
+_STOPWORDS = frozenset({
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "at", "for", "with", "about", "from", "by", "as",
+    "is", "are", "was", "were", "be", "been", "do", "does", "did", "can", "could", "would", "should", "will",
+    "i", "me", "my", "we", "us", "our", "you", "your", "it", "its", "this", "that", "these", "those",
+    "what", "which", "who", "how", "please", "tell", "say", "says", "there", "any", "some",
+})
+# Memory lookups that differ only by a name would return the wrong user, they are matched exactly only
+_EXACT_MATCH_AGENTS = frozenset({AgentName.UMS})
+
+
+@dataclass
+class CachedResponse:
+    agent_content: str
+    final_content: str
+    expires_at: float
+    embedding: Optional[dict[int, float]] = field(default=None, repr=False)
+    content_words: frozenset[str] = field(default=frozenset(), repr=False)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(_TOKEN_PATTERN.findall(text.lower()))
+
+
+def content_words(text: str) -> frozenset[str]:
+    return frozenset(word for word in normalize_text(text).split() if word not in _STOPWORDS)
+
+
+def embed_text(text: str) -> dict[int, float]:
+    """Local hashed bag-of-words embedding (unigrams + bigrams), L2 normalized"""
+    tokens = normalize_text(text).split()
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    vector: dict[int, float] = {}
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        idx = int.from_bytes(digest, 'big') % _EMBEDDING_DIMENSIONS
+        vector[idx] = vector.get(idx, 0.0) + 1.0
+
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else {}
+
+
+def cosine_similarity(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class ResponseCache:
+    """
+    Cache of read-only agent answers shared across conversations of the same caller.
+
+    The scope is a stable caller identity (the scheduler tenant id), not the raw per-request API key.
+    Entries are looked up by exact normalized question per scope and agent, and optionally by local embedding
+    similarity when `similarity_threshold` is set. The embedding is lexical, not semantic, so a similarity hit
+    also requires the same content words (questions may differ only in wording and order), and UMS entries are
+    matched exactly only. Only text is cached: agent state and attachments belong to the
+    conversation that produced them and are never replayed into another one. Any WRITE turn handled by an agent
+    invalidates that agent's entries in every scope. Entries and invalidation are local to the process, so with
+    several workers only agents whose answers are not changed by other requests should be cached.
+    """
+
+    def __init__(
+            self,
+            ttls: dict[AgentName, float],
+            max_entries: int = 512,
+            similarity_threshold: Optional[float] = None
+    ):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[tuple[str, AgentName, str], CachedResponse] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_text(user_message: str, additional_instructions: Optional[str]) -> str:
+        if additional_instructions:
+            return f"{user_message}\n\n{additional_instructions}"
+        return user_message
+
+    def get(self, scope: str, agent_name: AgentName, text: str) -> Optional[CachedResponse]:
+        now = time.monotonic()
+        key = (scope, agent_name, normalize_text(text))
+
+        # 1. Exact match
+        entry = self._entries.get(key)
+        if entry and entry.expires_at > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        # 2. Most similar non-expired entry of the same scope and agent asking about the same things
+        if self.similarity_threshold and agent_name not in _EXACT_MATCH_AGENTS:
+            embedding = embed_text(text)
+            words = content_words(text)
+            best_key, best_score = None, self.similarity_threshold
+            for entry_key, candidate in self._entries.items():
+                entry_scope, entry_agent, _ = entry_key
+                if entry_scope != scope or entry_agent is not agent_name:
+                    continue
+                if candidate.expires_at <= now or not candidate.embedding or candidate.content_words != words:
+                    continue
+                score = cosine_similarity(embedding, candidate.embedding)
+                if score >= best_score:
+                    best_key, best_score = entry_key, score
+
+            if best_key:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                logger.debug(f"Response cache similarity hit [agent={agent_name}, score={best_score:.3f}]")
+                return self._entries[best_key]
+
+        self.misses += 1
+        return None
+
+    def put(self, scope: str, agent_name: AgentName, text: str, agent_content: str, final_content: str) -> None:
+        ttl = self.ttls.get(agent_name, 0)
+        if ttl <= 0:
+            return
+
+        key = (scope, agent_name, normalize_text(text))
+        similarity = self.similarity_threshold and agent_name not in _EXACT_MATCH_AGENTS
+        self._entries[key] = CachedResponse(
+            agent_content=agent_content,
+            final_content=final_content,
+            expires_at=time.monotonic() + ttl,
+            embedding=embed_text(text) if similarity else None,
+            content_words=content_words(text) if similarity else frozenset(),
+        )
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, agent_name: AgentName) -> int:
+        keys = [key for key in self._entries if key[1] is agent_name]
+        for key in keys:
+            del self._entries[key]
+        if keys:
+            logger.info(f"Invalidated {len(keys)} cached {agent_name} responses")
+        return len(keys)
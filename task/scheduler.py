@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aidial_sdk.chat_completion import Request
+from aidial_sdk.exceptions import HTTPException as DIALException
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+logger = get_logger(__name__)
+
+_MAX_TRACKED_TENANTS = 1024
+_TENANT_METRICS = (
+    "scheduler_admitted_total",
+    "scheduler_rejected_total",
+    "scheduler_queue_wait_seconds",
+    "scheduler_queued",
+    "scheduler_in_flight",
+)
+
+
+class TooManyRequestsError(DIALException):
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(
+            message=message,
+            status_code=429,
+            type="rate_limit_error",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class _Tenant:
+
+    def __init__(self, tenant_id: str, weight: float, burst: float):
+        self.id = tenant_id
+        self.weight = weight
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.virtual_time = 0.0
+
+    def refill(self, rate: float, burst: float) -> None:
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.refilled_at) * rate)
+        self.refilled_at = now
+
+    @property
+    def idle(self) -> bool:
+        return not self.in_flight and not self.waiters
+
+
+class TenantScheduler:
+    """
+    Weighted fair admission of requests per tenant.
+
+    Every tenant has a token bucket (`rate` requests/sec, `burst` capacity) and a concurrency cap. Requests over
+    the cap wait in a per-tenant queue, and freed slots go to the waiting tenant with the lowest virtual time,
+    which advances by 1/weight per admitted request. Over quota, full queue or queue timeout fail fast with 429.
+
+    State lives in the worker process: with several workers every limit applies per worker, so the effective
+    deployment-wide limit is the configured one multiplied by the number of workers.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int,
+            tenant_concurrency: int,
+            rate: float,
+            burst: float,
+            max_queue: int,
+            queue_timeout: float,
+            weights: Optional[dict[str, float]] = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.weights = weights or {}
+        self.in_flight = 0
+        self._virtual_clock = 0.0
+        self._tenants: dict[str, _Tenant] = {}
+
+    @staticmethod
+    def tenant_id(request: Request, header: Optional[str] = None) -> str:
+        """
+        Tenant from configured header, otherwise hashed API key (raw keys never reach logs and metrics).
+        The API key is a stable identity only when callers reuse their keys, per-request keys need the header.
+        """
+        if header and (value := request.headers.get(header)):
+            return value
+        return "key-" + hashlib.sha256((request.api_key or '').encode('utf-8')).hexdigest()[:12]
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: str) -> AsyncIterator[None]:
+        tenant = self.__get_tenant(tenant_id)
+        self.__take_token(tenant)
+
+        started = time.perf_counter()
+        if not tenant.waiters and self.__can_run(tenant):
+            self.__admit(tenant)
+        else:
+            await self.__wait(tenant)
+        metrics.observe("scheduler_queue_wait_seconds", time.perf_counter() - started, tenant=tenant.id)
+
+        try:
+            yield
+        finally:
+            self.__release(tenant)
+
+    def __get_tenant(self, tenant_id: str) -> _Tenant:
+        if (tenant := self._tenants.get(tenant_id)) is None:
+            if len(self._tenants) >= _MAX_TRACKED_TENANTS:
+                self.__prune()
+            tenant = self._tenants[tenant_id] = _Tenant(tenant_id, self.weights.get(tenant_id, 1.0), self.burst)
+        return tenant
+
+    def __prune(self) -> None:
+        # Idle tenants with a full bucket carry no state worth keeping
+        for tenant in list(self._tenants.values()):
+            tenant.refill(self.rate, self.burst)
+            if tenant.idle and tenant.tokens >= self.burst:
+                del self._tenants[tenant.id]
+                # Series of forgotten tenants are dropped too, label cardinality stays bounded by tracked tenants
+                for name in _TENANT_METRICS:
+                    metrics.remove(name, tenant=tenant.id)
+
+    def __take_token(self, tenant: _Tenant) -> None:
+        if self.rate <= 0:
+            return
+        tenant.refill(self.rate, self.burst)
+        if tenant.tokens < 1:
+            self.__reject(tenant, "rate_limit", (1 - tenant.tokens) / self.rate)
+        tenant.tokens -= 1
+
+    def __can_run(self, tenant: _Tenant) -> bool:
+        return self.in_flight < self.max_concurrency and tenant.in_flight < self.tenant_concurrency
+
+    def __admit(self, tenant: _Tenant) -> None:
+        # Tenant returning from idle starts at the current clock instead of spending saved-up credit
+        if tenant.in_flight == 0:
+            tenant.virtual_time = max(tenant.virtual_time, self._virtual_clock)
+        self._virtual_clock = tenant.virtual_time
+        tenant.virtual_time += 1.0 / tenant.weight
+
+        tenant.in_flight += 1
+        self.in_flight += 1
+        metrics.inc("scheduler_admitted_total", tenant=tenant.id)
+        self.__update_gauges(tenant)
+
+    async def __wait(self, tenant: _Tenant) -> None:
+        if len(tenant.waiters) >= self.max_queue:
+            self.__reject(tenant, "queue_full", self.queue_timeout)
+
+        waiter = asyncio.get_running_loop().create_future()
+        tenant.waiters.append(waiter)
+        self.__update_gauges(tenant)
+        try:
+            # Not wait_for: on Python 3.11 it swallows the cancellation when the slot was granted in the meantime
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was granted while the waiter gave up, hand it over to the next one
+                self.__release(tenant)
+            else:
+                waiter.cancel()
+                tenant.waiters.remove(waiter)
+                self.__update_gauges(tenant)
+            if isinstance(e, asyncio.TimeoutError):
+                self.__reject(tenant, "queue_timeout", self.queue_timeout)
+            raise
+
+    def __release(self, tenant: _Tenant) -> None:
+        tenant.in_flight -= 1
+        self.in_flight -= 1
+        self.__update_gauges(tenant)
+        self.__dispatch()
+
+    def __dispatch(self) -> None:
+        while self.in_flight < self.max_concurrency:
+            eligible = [t for t in self._tenants.values() if t.waiters and t.in_flight < self.tenant_concurrency]
+            if not eligible:
+                return
+
+            tenant = min(eligible, key=lambda t: t.virtual_time)
+            waiter = tenant.waiters.popleft()
+            self.__admit(tenant)
+            waiter.set_result(None)
+
+    def __reject(self, tenant: _Tenant, reason: str, retry_after: float) -> None:
+        metrics.inc("scheduler_rejected_total", tenant=tenant.id, reason=reason)
+        logger.warning(f"Rejected request [tenant={tenant.id}, reason={reason}]")
+        raise TooManyRequestsError(f"Too many requests for tenant ({reason.replace('_', ' ')})", retry_after)
+
+    def __update_gauges(self, tenant: _Tenant) -> None:
+        metrics.set("scheduler_queued", len(tenant.waiters), tenant=tenant.id)
+        metrics.set("scheduler_in_flight", tenant.in_flight, tenant=tenant.id)
+        metrics.set("scheduler_in_flight_total", self.in_flight)
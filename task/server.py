@@ -0,0 +1,119 @@
+import asyncio
+import importlib.util
+import math
+import os
+import signal
+from typing import Any
+
+from task.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def _available_cpus() -> int:
+    """CPUs this process may run on, capped by the cgroup CPU quota (v2, then v1) when one is set"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    try:
+        return max(1, min(cpus, math.ceil(int(quota) / int(period))))
+    except (ValueError, ZeroDivisionError):
+        return cpus
+
+
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', '8055'))
+# Host CPU count overstates what a container may use, workers follow CPU affinity and the cgroup quota
+WORKERS = int(os.getenv('WORKERS', str(_available_cpus())))
+BACKLOG = int(os.getenv('BACKLOG', '2048'))
+TIMEOUT_KEEP_ALIVE = int(os.getenv('TIMEOUT_KEEP_ALIVE', '75'))
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', '120'))
+DRAIN_DELAY = float(os.getenv('DRAIN_DELAY', '5'))
+LIMIT_CONCURRENCY = int(os.getenv('LIMIT_CONCURRENCY', '0')) or None
+
+
+class ServerState:
+    """Readiness of the current worker: ready after downstream warm-up, not ready once draining started"""
+
+    def __init__(self):
+        self.warmed_up = False
+        self.draining = False
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed_up and not self.draining
+
+    def install_drain_handler(self) -> None:
+        """
+        Chain SIGTERM/SIGINT handlers installed by uvicorn to flip readiness before shutdown.
+
+        On SIGTERM readiness is flipped first and uvicorn's handler runs `DRAIN_DELAY` seconds later, giving load
+        balancers time to stop routing new requests here while the listener still accepts them. Uvicorn then stops
+        accepting connections and waits up to `timeout_graceful_shutdown` for in-flight streams to finish.
+        SIGINT and a repeated signal shut down without delay. Must be called from the lifespan startup, after
+        uvicorn captured the signals.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+
+            def handler(signum: int, frame: Any, previous=previous if callable(previous) else None) -> None:
+                if not self.draining:
+                    logger.info(f"Received signal {signal.Signals(signum).name}, draining in-flight requests")
+                    self.draining = True
+                    if signum == signal.SIGTERM and DRAIN_DELAY > 0 and previous:
+                        loop.call_soon_threadsafe(loop.call_later, DRAIN_DELAY, previous, signum, frame)
+                        return
+                if previous:
+                    previous(signum, frame)
+
+            signal.signal(sig, handler)
+
+
+server_state = ServerState()
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def run_production(app_path: str = "task.app:app") -> None:
+    """Run multi-worker uvicorn server with uvloop/httptools when available and graceful drain"""
+    import uvicorn
+
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+
+    logger.info(
+        f"Starting production server on {HOST}:{PORT} "
+        f"[workers={WORKERS}, loop={loop}, http={http}, backlog={BACKLOG}, keep_alive={TIMEOUT_KEEP_ALIVE}s, "
+        f"drain_delay={DRAIN_DELAY}s, drain_timeout={DRAIN_TIMEOUT}s]"
+    )
+    uvicorn.run(
+        app_path,
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        loop=loop,
+        http=http,
+        backlog=BACKLOG,
+        timeout_keep_alive=TIMEOUT_KEEP_ALIVE,
+        timeout_graceful_shutdown=DRAIN_TIMEOUT,
+        limit_concurrency=LIMIT_CONCURRENCY,
+        log_level="info",
+    )
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aidial_sdk.chat_completion import Choice, Request, Message, Stage
+
+from task.coordination.gpa import _IS_GPA
+from task.coordination.ums_agent import _UMS_CONVERSATION_ID
+from task.logging_config import get_logger
+from task.metrics import metrics
+from task.models import AgentName, CoordinationRequest
+from task.stage_util import StageProcessor
+
+logger = get_logger(__name__)
+
+
+class _SpeculativeQueue:
+    """Buffers chunks until the speculation is committed, then forwards them to the real choice"""
+
+    def __init__(self):
+        self.buffer: list[Any] = []
+        self.target: Optional[Choice] = None
+
+    def put_nowait(self, chunk: Any) -> None:
+        if self.target is None:
+            self.buffer.append(chunk)
+        else:
+            self.target.send_chunk(chunk)
+
+    def flush_to(self, target: Choice) -> None:
+        for chunk in self.buffer:
+            target.send_chunk(chunk)
+        self.buffer.clear()
+        self.target = target
+
+
+class SpeculativeDispatch:
+    """
+    Agent request started concurrently with routing, on a guess that the conversation stays with the agent
+    that handled the previous turn.
+
+    The agent writes to a shadow choice whose chunks are buffered. When routing agrees the buffer is flushed
+    to the real choice and the rest of the stream is forwarded live, otherwise the request is cancelled.
+    """
+
+    def __init__(self, agent_name: AgentName, choice: Choice, queue: _SpeculativeQueue, shadow: Choice):
+        self.agent_name = agent_name
+        self.choice = choice
+        self.queue = queue
+        self.shadow = shadow
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.settled = False
+
+    @staticmethod
+    def previous_agent(request: Request) -> Optional[AgentName]:
+        """Agent that handled the previous turn, based on the state it left in the last assistant message"""
+        for msg in reversed(request.messages):
+            if msg.custom_content and msg.custom_content.state:
+                state = msg.custom_content.state
+                if state.get(_IS_GPA):
+                    return AgentName.GPA
+                if state.get(_UMS_CONVERSATION_ID):
+                    return AgentName.UMS
+        return None
+
+    @classmethod
+    def start(
+            cls,
+            agent_name: AgentName,
+            choice: Choice,
+            run: Callable[[CoordinationRequest, Choice, Stage], Awaitable[Message]]
+    ) -> "SpeculativeDispatch":
+        # Shadow choice continues stage and attachment numbering of the real choice
+        queue = _SpeculativeQueue()
+        shadow = Choice(queue, choice.index)
+        shadow._opened = True
+        shadow._last_stage_index = choice._last_stage_index
+        shadow._last_attachment_index = choice._last_attachment_index
+
+        speculation = cls(agent_name, choice, queue, shadow)
+        speculation.task = asyncio.create_task(speculation.__run(run))
+        metrics.inc("speculative_dispatch_total", agent=agent_name)
+        return speculation
+
+    def matches(self, coordination_request: CoordinationRequest) -> bool:
+        # Speculative request was sent without additional instructions
+        return (
+                coordination_request.agent_name is self.agent_name
+                and not coordination_request.additional_instructions
+        )
+
+    async def commit(self) -> Message:
+        self.settled = True
+        self.__record_outcome(hit=True)
+        logger.info(f"Speculative {self.agent_name} dispatch committed [buffered_chunks={len(self.queue.buffer)}]")
+        self.queue.flush_to(self.choice)
+
+        agent_message = await self.task
+
+        # Real choice takes over numbering after the shadow finished
+        self.choice._last_stage_index = self.shadow._last_stage_index
+        self.choice._last_attachment_index = self.shadow._last_attachment_index
+        self.choice._state_submitted = self.shadow._state_submitted
+        return agent_message
+
+    async def cancel(self) -> None:
+        """Stop the agent call, safe to call after commit (e.g. when the request fails later)"""
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        if self.settled:
+            return
+        self.settled = True
+
+        wasted_seconds = (self.finished or time.perf_counter()) - self.started
+        self.__record_outcome(hit=False)
+        metrics.inc("speculative_wasted_chunks_total", len(self.queue.buffer), agent=self.agent_name)
+        metrics.inc("speculative_wasted_seconds_total", wasted_seconds, agent=self.agent_name)
+        logger.info(f"Speculative {self.agent_name} dispatch cancelled [discarded_chunks={len(self.queue.buffer)}]")
+        self.queue.buffer.clear()
+
+    def __record_outcome(self, hit: bool) -> None:
+        metrics.inc("speculative_hits_total" if hit else "speculative_misses_total", agent=self.agent_name)
+        hits = metrics.get("speculative_hits_total", agent=self.agent_name)
+        misses = metrics.get("speculative_misses_total", agent=self.agent_name)
+        metrics.set("speculative_hit_rate", hits / (hits + misses), agent=self.agent_name)
+
+    async def __run(self, run: Callable[[CoordinationRequest, Choice, Stage], Awaitable[Message]]) -> Message:
+        stage = StageProcessor.open_stage(self.shadow, f"Call {self.agent_name} Agent")
+        try:
+            return await run(CoordinationRequest(agent_name=self.agent_name), self.shadow, stage)
+        finally:
+            StageProcessor.close_stage_safely(stage)
+            self.finished = time.perf_counter()
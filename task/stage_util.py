@@ -1,6 +1,6 @@
 from typing import Optional
 
-from aidial_sdk.chat_completion import Choice, Stage
+from aidial_sdk.chat_completion import Choice, Stage, Status
 
 
 class StageProcessor:
@@ -12,9 +12,9 @@ class StageProcessor:
         return stage
 
     @staticmethod
-    def close_stage_safely(stage: Stage) -> None:
+    def close_stage_safely(stage: Stage, status: Status = Status.COMPLETED) -> None:
         try:
             if not stage._closed:
-                stage.close()
+                stage.close(status)
         except Exception as e:
             print("⚠️ Unable to close stage. ", e)
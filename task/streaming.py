@@ -0,0 +1,206 @@
+import asyncio
+import os
+import tempfile
+import time
+from collections import deque
+from enum import StrEnum
+from typing import Any, AsyncIterator, Callable, Generic, Optional, TypeVar
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class BufferPolicy(StrEnum):
+    BLOCK = "block"
+    COALESCE = "coalesce"
+    SPILL = "spill"
+
+
+STREAM_BUFFER_HIGH_WATERMARK = int(os.getenv('STREAM_BUFFER_HIGH_WATERMARK', '256'))
+STREAM_BUFFER_LOW_WATERMARK = int(os.getenv('STREAM_BUFFER_LOW_WATERMARK', '64'))
+STREAM_BUFFER_POLICY = BufferPolicy(os.getenv('STREAM_BUFFER_POLICY', BufferPolicy.COALESCE))
+STREAM_DOWNSTREAM_HIGH_WATERMARK = int(os.getenv('STREAM_DOWNSTREAM_HIGH_WATERMARK', '512'))
+
+
+class _SpillFile:
+    """Append-only overflow of serialized items, read back in order"""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._write_pos = 0
+        self._read_pos = 0
+        self.pending = 0
+
+    def write(self, line: str) -> None:
+        self._file.seek(self._write_pos)
+        self._file.write(line.encode('utf-8') + b"\n")
+        self._write_pos = self._file.tell()
+        self.pending += 1
+
+    def read(self) -> str:
+        self._file.seek(self._read_pos)
+        line = self._file.readline()
+        self._read_pos = self._file.tell()
+        self.pending -= 1
+        if not self.pending:
+            # Drained, reuse the file from the start
+            self._file.seek(0)
+            self._file.truncate()
+            self._write_pos = self._read_pos = 0
+        return line.decode('utf-8').rstrip("\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class StreamPipeline(Generic[T]):
+    """
+    Decouples reading an upstream agent stream from writing it downstream.
+
+    A reader task pulls upstream items into a bounded buffer while the caller consumes them. When the buffer
+    reaches the high watermark the reader applies the policy: BLOCK pauses reading until the buffer drains
+    to the low watermark, COALESCE merges the item into the last buffered one (blocking when they cannot be
+    merged), SPILL writes items to a temporary file. The consumer in turn waits for the client to drain the
+    response queue once it holds more than `downstream_high_watermark` chunks. Buffered items belong to the
+    pipeline until consumed, so `coalesce` may update the last one in place and return it.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            upstream: AsyncIterator[T],
+            downstream_queue: Any,
+            coalesce: Optional[Callable[[T, T], Optional[T]]] = None,
+            dumps: Optional[Callable[[T], str]] = None,
+            loads: Optional[Callable[[str], T]] = None,
+            policy: BufferPolicy = STREAM_BUFFER_POLICY,
+            high_watermark: int = STREAM_BUFFER_HIGH_WATERMARK,
+            low_watermark: int = STREAM_BUFFER_LOW_WATERMARK,
+            downstream_high_watermark: int = STREAM_DOWNSTREAM_HIGH_WATERMARK
+    ):
+        self.name = name
+        self.upstream = upstream
+        self.downstream_queue = downstream_queue
+        self.coalesce = coalesce
+        self.dumps = dumps
+        self.loads = loads
+        self.policy = policy
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.downstream_high_watermark = downstream_high_watermark
+        self._buffer: deque[T] = deque()
+        self._spill: Optional[_SpillFile] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._upstream_stall = 0.0
+        self._downstream_stall = 0.0
+        self._backpressure = 0.0
+
+    async def __aenter__(self) -> "StreamPipeline[T]":
+        self._reader = asyncio.create_task(self.__read())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._reader.cancel()
+        await asyncio.gather(self._reader, return_exceptions=True)
+        if self._spill:
+            self._spill.close()
+
+        metrics.observe("stream_upstream_stall_seconds", self._upstream_stall, gateway=self.name)
+        metrics.observe("stream_downstream_stall_seconds", self._downstream_stall, gateway=self.name)
+        metrics.observe("stream_backpressure_seconds", self._backpressure, gateway=self.name)
+        logger.debug(
+            f"Stream pipeline finished [gateway={self.name}, upstream_stall={self._upstream_stall:.3f}s, "
+            f"downstream_stall={self._downstream_stall:.3f}s, backpressure={self._backpressure:.3f}s]"
+        )
+
+    def __aiter__(self) -> AsyncIterator[T]:
+        return self.__consume()
+
+    async def __consume(self) -> AsyncIterator[T]:
+        while True:
+            # 1. Client is slow, let the response queue drain before writing more
+            if self.__downstream_backlog() > self.downstream_high_watermark:
+                started = time.perf_counter()
+                await self.downstream_queue.join()
+                self._downstream_stall += time.perf_counter() - started
+
+            # 2. Take next item, waiting for upstream when nothing is buffered
+            if not self._buffer and not (self._spill and self._spill.pending):
+                if self._done:
+                    break
+                started = time.perf_counter()
+                while not self._buffer and not (self._spill and self._spill.pending) and not self._done:
+                    self._readable.clear()
+                    await self._readable.wait()
+                self._upstream_stall += time.perf_counter() - started
+                continue
+
+            if self._buffer:
+                item = self._buffer.popleft()
+            else:
+                item = self.loads(self._spill.read())
+            if len(self._buffer) <= self.low_watermark:
+                self._writable.set()
+            yield item
+
+        if self._error is not None:
+            raise self._error
+
+    async def __read(self) -> None:
+        try:
+            async for item in self.upstream:
+                await self.__put(item)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._readable.set()
+
+    async def __put(self, item: T) -> None:
+        # Items go to the spill file while it holds anything, to keep the order
+        if self._spill and self._spill.pending:
+            self.__spill(item)
+            return
+
+        if len(self._buffer) >= self.high_watermark:
+            if self.policy is BufferPolicy.COALESCE and self.coalesce and self._buffer:
+                if (merged := self.coalesce(self._buffer[-1], item)) is not None:
+                    self._buffer[-1] = merged
+                    metrics.inc("stream_buffer_coalesced_total", gateway=self.name)
+                    return
+            if self.policy is BufferPolicy.SPILL and self.dumps and self.loads:
+                self.__spill(item)
+                return
+
+            # Block: stop reading upstream until the consumer catches up
+            started = time.perf_counter()
+            while len(self._buffer) > self.low_watermark:
+                self._writable.clear()
+                await self._writable.wait()
+            self._backpressure += time.perf_counter() - started
+
+        self._buffer.append(item)
+        self._readable.set()
+
+    def __spill(self, item: T) -> None:
+        if self._spill is None:
+            self._spill = _SpillFile()
+        self._spill.write(self.dumps(item))
+        metrics.inc("stream_buffer_spilled_total", gateway=self.name)
+        self._readable.set()
+
+    def __downstream_backlog(self) -> int:
+        # Speculative and other in-memory queues have no consumer to wait for
+        if not hasattr(self.downstream_queue, "join"):
+            return 0
+        return self.downstream_queue.qsize()
@@ -0,0 +1,204 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+logger = get_logger(__name__)
+
+_Origin = tuple[str, str, Optional[int]]
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that frees the stream slot once the body is closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+@dataclass
+class _Lane:
+    """Single HTTP/2 connection carrying up to `max_streams` concurrent requests"""
+    transport: httpx.AsyncHTTPTransport
+    active: int = 0
+
+
+@dataclass
+class _OriginLanes:
+    lanes: list[_Lane] = field(default_factory=list)
+    waiters: deque[asyncio.Future] = field(default_factory=deque)
+
+
+class MultiplexedTransport(httpx.AsyncBaseTransport):
+    """
+    HTTP/2 transport spreading concurrent requests over a few connections per origin.
+
+    Every connection (lane) carries at most `max_streams_per_connection` streams, new lanes are opened only
+    when all existing ones are full, up to `max_connections`. Cleartext origins use h2c with prior knowledge,
+    TLS origins negotiate the protocol via ALPN. When an origin does not speak HTTP/2 the transport falls
+    back to a regular HTTP/1.1 pool for that origin.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            limits: httpx.Limits,
+            max_streams_per_connection: int,
+            fallback: httpx.AsyncBaseTransport
+    ):
+        self.name = name
+        self.limits = limits
+        self.max_streams_per_connection = max_streams_per_connection
+        self.fallback = fallback
+        self._origins: dict[_Origin, _OriginLanes] = {}
+        self._http1_origins: set[_Origin] = set()
+        self._http2_origins: set[_Origin] = set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        origin = (request.url.scheme, request.url.host, request.url.port)
+        if origin in self._http1_origins:
+            return await self.fallback.handle_async_request(request)
+
+        lanes = self._origins.setdefault(origin, _OriginLanes())
+        lane = await self.__acquire(origin, lanes)
+        try:
+            response = await lane.transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            self.__release(lanes, lane)
+            # Connection dropped before the origin ever answered over HTTP/2, the request is resent over HTTP/1.1
+            if origin in self._http2_origins or isinstance(e, (httpx.ConnectError, httpx.TimeoutException)):
+                raise
+            self.__fall_back(origin, f"{type(e).__name__} before any HTTP/2 response")
+            return await self.fallback.handle_async_request(request)
+        except BaseException:
+            self.__release(lanes, lane)
+            raise
+
+        if response.extensions.get("http_version") == b"HTTP/2":
+            self._http2_origins.add(origin)
+        else:
+            # ALPN negotiated HTTP/1.1, lanes would serialize requests on a single connection
+            self.__fall_back(origin, "HTTP/2 not negotiated")
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, lambda: self.__release(lanes, lane)),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        for lanes in self._origins.values():
+            for lane in lanes.lanes:
+                await lane.transport.aclose()
+        self._origins.clear()
+        await self.fallback.aclose()
+
+    async def __acquire(self, origin: _Origin, lanes: _OriginLanes) -> _Lane:
+        while True:
+            free = [lane for lane in lanes.lanes if lane.active < self.max_streams_per_connection]
+            if free:
+                lane = min(free, key=lambda lane: lane.active)
+                break
+            if self.limits.max_connections is None or len(lanes.lanes) < self.limits.max_connections:
+                lane = _Lane(self.__create_lane_transport(origin))
+                lanes.lanes.append(lane)
+                metrics.set("http2_connections", len(lanes.lanes), pool=self.name)
+                break
+
+            # All connections carry max streams, wait for any stream to finish
+            waiter = asyncio.get_running_loop().create_future()
+            lanes.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.__wake(lanes)
+                else:
+                    lanes.waiters.remove(waiter)
+                raise
+
+        lane.active += 1
+        self.__update_streams()
+        return lane
+
+    def __release(self, lanes: _OriginLanes, lane: _Lane) -> None:
+        lane.active -= 1
+        self.__update_streams()
+        self.__wake(lanes)
+
+    @staticmethod
+    def __wake(lanes: _OriginLanes) -> None:
+        while lanes.waiters:
+            waiter = lanes.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def __create_lane_transport(self, origin: _Origin) -> httpx.AsyncHTTPTransport:
+        return httpx.AsyncHTTPTransport(
+            http1=origin[0] == "https",
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=1,
+                max_keepalive_connections=1,
+                keepalive_expiry=self.limits.keepalive_expiry,
+            ),
+        )
+
+    def __fall_back(self, origin: _Origin, reason: str) -> None:
+        if origin not in self._http1_origins:
+            self._http1_origins.add(origin)
+            metrics.inc("http2_fallback_total", pool=self.name)
+            logger.warning(
+                f"Falling back to HTTP/1.1 for {origin[0]}://{origin[1]}:{origin[2]} [pool={self.name}]: {reason}"
+            )
+
+    def __update_streams(self) -> None:
+        active = sum(lane.active for lanes in self._origins.values() for lane in lanes.lanes)
+        metrics.set("http2_active_streams", active, pool=self.name)
+
+
+def create_transport(
+        name: str,
+        limits: httpx.Limits,
+        http2: bool,
+        max_streams_per_connection: int
+) -> httpx.AsyncBaseTransport:
+    """HTTP/2 multiplexed transport when enabled and `h2` is installed, plain HTTP/1.1 pool otherwise"""
+    http1_transport = httpx.AsyncHTTPTransport(limits=limits)
+    if not http2:
+        return http1_transport
+    if h2 is None:
+        logger.warning(f"HTTP/2 requested for {name} pool but 'h2' is not installed (pip install httpx[http2])")
+        return http1_transport
+
+    return MultiplexedTransport(
+        name=name,
+        limits=limits,
+        max_streams_per_connection=max_streams_per_connection,
+        fallback=http1_transport,
+    )
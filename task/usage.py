@@ -0,0 +1,114 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aidial_sdk.chat_completion import Response
+
+from task.logging_config import get_logger
+from task.metrics import metrics
+
+logger = get_logger(__name__)
+
+THROUGHPUT_BUCKETS: tuple[float, ...] = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+RATIO_BUCKETS: tuple[float, ...] = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _usage_value(usage: Any, name: str) -> int:
+    # Usage arrives as client model from DIAL calls and as plain dict from UMS SSE chunks
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return int(value or 0)
+
+
+def _cached_tokens(usage: Any) -> int:
+    # Upstream prompt cache hits are reported in usage.prompt_tokens_details.cached_tokens
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details")
+    else:
+        details = getattr(usage, "prompt_tokens_details", None)
+    return _usage_value(details, "cached_tokens") if details else 0
+
+
+@dataclass
+class StageUsage:
+    stage: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    duration: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.completion_tokens / self.duration if self.duration > 0 else 0.0
+
+
+class UsageTracker:
+    """Collects token usage of every LLM/agent call made while handling one request"""
+
+    def __init__(self):
+        self.stages: list[StageUsage] = []
+
+    @staticmethod
+    def start() -> float:
+        return time.perf_counter()
+
+    def record(self, stage: str, model: str, usage: Optional[Any], started: float) -> StageUsage:
+        stage_usage = StageUsage(
+            stage=stage,
+            model=model,
+            prompt_tokens=_usage_value(usage, "prompt_tokens") if usage else 0,
+            completion_tokens=_usage_value(usage, "completion_tokens") if usage else 0,
+            cached_tokens=_cached_tokens(usage) if usage else 0,
+            duration=time.perf_counter() - started,
+        )
+        self.stages.append(stage_usage)
+
+        metrics.inc("llm_prompt_tokens_total", stage_usage.prompt_tokens, stage=stage, model=model)
+        metrics.inc("llm_completion_tokens_total", stage_usage.completion_tokens, stage=stage, model=model)
+        metrics.inc("llm_cached_prompt_tokens_total", stage_usage.cached_tokens, stage=stage, model=model)
+        if stage_usage.prompt_tokens:
+            metrics.observe(
+                "llm_prompt_cache_hit_ratio",
+                stage_usage.cached_tokens / stage_usage.prompt_tokens,
+                buckets=RATIO_BUCKETS,
+                stage=stage
+            )
+        metrics.observe("llm_stage_duration_seconds", stage_usage.duration, stage=stage)
+        if stage_usage.completion_tokens:
+            metrics.observe(
+                "llm_tokens_per_second", stage_usage.tokens_per_second, buckets=THROUGHPUT_BUCKETS, stage=stage
+            )
+        logger.info(
+            f"Usage [stage={stage}, model={model}, prompt_tokens={stage_usage.prompt_tokens}, "
+            f"cached_tokens={stage_usage.cached_tokens}, "
+            f"completion_tokens={stage_usage.completion_tokens}, duration={stage_usage.duration:.2f}s, "
+            f"tokens_per_second={stage_usage.tokens_per_second:.1f}]"
+        )
+        return stage_usage
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(s.prompt_tokens for s in self.stages)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(s.completion_tokens for s in self.stages)
+
+    def report(self, response: Response) -> None:
+        """Propagate collected usage to the DIAL response (per model and total)"""
+        if not self.stages:
+            return
+
+        per_model: dict[str, list[int]] = {}
+        for stage_usage in self.stages:
+            model_usage = per_model.setdefault(stage_usage.model, [0, 0])
+            model_usage[0] += stage_usage.prompt_tokens
+            model_usage[1] += stage_usage.completion_tokens
+
+        for model, (prompt_tokens, completion_tokens) in per_model.items():
+            response.add_usage_per_model(model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        response.set_usage(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens)
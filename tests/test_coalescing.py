@@ -0,0 +1,166 @@
+import asyncio
+from types import SimpleNamespace
+
+from aidial_sdk.chat_completion import Choice, Message
+
+from task.coalescing import RequestCoalescer
+
+
+class _Queue(list):
+
+    def put_nowait(self, chunk):
+        self.append(chunk)
+
+
+def _choice() -> Choice:
+    # Requests open their own choice before handing it to the coalescer
+    choice = Choice(_Queue(), 0)
+    choice._opened = True
+    return choice
+
+
+def _content(choice: Choice) -> str:
+    return "".join(chunk.to_dict()["choices"][0]["delta"].get("content", "") for chunk in choice._queue)
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class _Producer:
+    """Streams `parts` one by one, each released by `step`"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.calls = 0
+        self.cancelled = False
+        self.step = asyncio.Semaphore(0)
+
+    async def __call__(self, choice: Choice) -> None:
+        self.calls += 1
+        try:
+            for part in self.parts:
+                await self.step.acquire()
+                choice.append_content(part)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    def release(self, steps: int = 1) -> None:
+        for _ in range(steps):
+            self.step.release()
+
+
+def test_followers_receive_all_chunks_of_single_run():
+    async def scenario():
+        coalescer = RequestCoalescer()
+        producer = _Producer(["a", "b", "c"])
+        choices = [_choice() for _ in range(3)]
+
+        leader = asyncio.create_task(coalescer.run("key", choices[0], producer))
+        await _settle()
+        producer.release()
+        await _settle()
+        # Late followers get the chunks produced before they attached
+        followers = [asyncio.create_task(coalescer.run("key", choice, producer)) for choice in choices[1:]]
+        await _settle()
+        producer.release(2)
+        await asyncio.gather(leader, *followers)
+
+        assert producer.calls == 1
+        assert [_content(choice) for choice in choices] == ["abc"] * 3
+        assert not coalescer._flights
+
+    asyncio.run(scenario())
+
+
+def test_leader_cancel_does_not_stop_flight_with_followers():
+    async def scenario():
+        coalescer = RequestCoalescer()
+        producer = _Producer(["a", "b"])
+        leader_choice, follower_choice = _choice(), _choice()
+
+        leader = asyncio.create_task(coalescer.run("key", leader_choice, producer))
+        await _settle()
+        follower = asyncio.create_task(coalescer.run("key", follower_choice, producer))
+        await _settle()
+
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        producer.release(2)
+        await follower
+
+        assert not producer.cancelled
+        assert _content(follower_choice) == "ab"
+
+    asyncio.run(scenario())
+
+
+def test_last_subscriber_cancel_stops_flight():
+    async def scenario():
+        coalescer = RequestCoalescer()
+        producer = _Producer(["a", "b"])
+
+        leader = asyncio.create_task(coalescer.run("key", _choice(), producer))
+        await _settle()
+        follower = asyncio.create_task(coalescer.run("key", _choice(), producer))
+        await _settle()
+        flight = coalescer._flights["key"]
+
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        assert flight.followers == 0
+        assert not producer.cancelled
+
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        await _settle()
+        assert producer.cancelled
+        assert flight.task.cancelled()
+        # Next identical request starts a new flight instead of joining the cancelled one
+        assert "key" not in coalescer._flights
+
+    asyncio.run(scenario())
+
+
+def test_producer_error_is_raised_to_every_subscriber():
+    async def scenario():
+        coalescer = RequestCoalescer()
+
+        async def failing(choice: Choice) -> None:
+            await asyncio.sleep(0)
+            raise ValueError("pipeline failed")
+
+        return await asyncio.gather(
+            coalescer.run("key", _choice(), failing),
+            coalescer.run("key", _choice(), failing),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_request_key_is_scoped_to_caller():
+    request = SimpleNamespace(
+        headers={"x-conversation-id": "conversation"},
+        messages=[Message(role="user", content="hello")],
+    )
+    assert RequestCoalescer.request_key(request, "key-a") == RequestCoalescer.request_key(request, "key-a")
+    assert RequestCoalescer.request_key(request, "key-a") != RequestCoalescer.request_key(request, "key-b")
+
+    request.headers = {}
+    assert RequestCoalescer.request_key(request, "key-a") is None
+
+
+def test_request_without_key_runs_producer_on_own_choice():
+    async def produce(target: Choice) -> None:
+        target.append_content("solo")
+
+    async def scenario():
+        choice = _choice()
+        await RequestCoalescer().run(None, choice, produce)
+        return _content(choice)
+
+    assert asyncio.run(scenario()) == "solo"
@@ -0,0 +1,94 @@
+import time
+
+from task.models import AgentName
+from task.response_cache import ResponseCache
+
+DEFROST = "What does the manual say about defrost?"
+
+
+def _cache(similarity_threshold=None, **overrides) -> ResponseCache:
+    options = dict(ttls={AgentName.GPA: 60, AgentName.UMS: 60}, max_entries=8)
+    options.update(overrides)
+    return ResponseCache(similarity_threshold=similarity_threshold, **options)
+
+
+def _put(cache: ResponseCache, text: str, agent_name=AgentName.GPA, scope="key-a", answer="answer") -> None:
+    cache.put(scope=scope, agent_name=agent_name, text=text, agent_content=f"{answer} context", final_content=answer)
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = _cache()
+    _put(cache, DEFROST, answer="defrost answer")
+
+    cached = cache.get("key-a", AgentName.GPA, "what does the manual say about DEFROST")
+    assert cached.final_content == "defrost answer"
+    assert cached.agent_content == "defrost answer context"
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_similar_question_about_other_subject_is_a_miss():
+    cache = _cache(similarity_threshold=0.8)
+    _put(cache, DEFROST)
+
+    assert cache.get("key-a", AgentName.GPA, "What does the manual say about grill?") is None
+    assert cache.misses == 1
+
+
+def test_similarity_hit_requires_same_content_words():
+    cache = _cache(similarity_threshold=0.8)
+    _put(cache, DEFROST, answer="defrost answer")
+
+    cached = cache.get("key-a", AgentName.GPA, "About defrost, what does the manual say?")
+    assert cached.final_content == "defrost answer"
+
+
+def test_ums_entries_are_matched_exactly_only():
+    cache = _cache(similarity_threshold=0.5)
+    _put(cache, "Do we have user John", agent_name=AgentName.UMS, answer="John")
+
+    assert cache.get("key-a", AgentName.UMS, "Do we have user John Smith") is None
+    assert cache.get("key-a", AgentName.UMS, "we have user John, do") is None
+    assert cache.get("key-a", AgentName.UMS, "do we have user john?").final_content == "John"
+
+
+def test_entries_are_scoped_to_caller_and_agent():
+    cache = _cache()
+    _put(cache, DEFROST)
+
+    assert cache.get("key-b", AgentName.GPA, DEFROST) is None
+    assert cache.get("key-a", AgentName.UMS, DEFROST) is None
+    assert cache.get("key-a", AgentName.GPA, DEFROST) is not None
+
+
+def test_invalidate_drops_agent_entries_in_every_scope():
+    cache = _cache()
+    _put(cache, "list my memories", agent_name=AgentName.UMS, scope="key-a")
+    _put(cache, "list my memories", agent_name=AgentName.UMS, scope="key-b")
+    _put(cache, DEFROST, scope="key-a")
+
+    assert cache.invalidate(AgentName.UMS) == 2
+    assert cache.get("key-a", AgentName.UMS, "list my memories") is None
+    assert cache.get("key-b", AgentName.UMS, "list my memories") is None
+    assert cache.get("key-a", AgentName.GPA, DEFROST) is not None
+
+
+def test_agents_without_ttl_are_not_cached_and_entries_expire():
+    cache = _cache(ttls={AgentName.GPA: 0.01, AgentName.UMS: 0})
+    _put(cache, "list my memories", agent_name=AgentName.UMS)
+    _put(cache, DEFROST)
+    assert cache.get("key-a", AgentName.UMS, "list my memories") is None
+
+    time.sleep(0.02)
+    assert cache.get("key-a", AgentName.GPA, DEFROST) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = _cache(max_entries=2)
+    _put(cache, "first question")
+    _put(cache, "second question")
+    cache.get("key-a", AgentName.GPA, "first question")
+    _put(cache, "third question")
+
+    assert cache.get("key-a", AgentName.GPA, "second question") is None
+    assert cache.get("key-a", AgentName.GPA, "first question") is not None
+    assert cache.get("key-a", AgentName.GPA, "third question") is not None
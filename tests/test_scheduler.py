@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from task.scheduler import TenantScheduler, TooManyRequestsError
+
+
+def _scheduler(**overrides) -> TenantScheduler:
+    options = dict(
+        max_concurrency=10,
+        tenant_concurrency=10,
+        rate=0,
+        burst=10,
+        max_queue=10,
+        queue_timeout=5,
+    )
+    options.update(overrides)
+    return TenantScheduler(**options)
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def _hold(scheduler, tenant_id, admitted, release):
+    async with scheduler.slot(tenant_id):
+        admitted.append(tenant_id)
+        await release.wait()
+
+
+def test_token_bucket_rejects_with_retry_after():
+    async def scenario():
+        scheduler = _scheduler(rate=0.5, burst=2)
+        for _ in range(2):
+            async with scheduler.slot("a"):
+                pass
+        with pytest.raises(TooManyRequestsError) as error:
+            async with scheduler.slot("a"):
+                pass
+        # Other tenants have their own bucket
+        async with scheduler.slot("b"):
+            pass
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.type == "rate_limit_error"
+    assert error.headers["Retry-After"] == "2"
+
+
+def test_tenant_concurrency_cap_queues_only_that_tenant():
+    async def scenario():
+        scheduler = _scheduler(tenant_concurrency=1)
+        admitted, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(_hold(scheduler, tenant, admitted, release)) for tenant in ("a", "a", "b")]
+        await _settle()
+        assert admitted == ["a", "b"]
+        assert scheduler.in_flight == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert admitted == ["a", "b", "a"]
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_are_dispatched_by_weight():
+    async def scenario():
+        scheduler = _scheduler(max_concurrency=1, tenant_concurrency=1, weights={"a": 2.0})
+        admitted, release = [], asyncio.Event()
+        holder = scheduler.slot("holder")
+        await holder.__aenter__()
+
+        # Both tenants queue up while the only slot is taken
+        tasks = [
+            asyncio.create_task(_hold(scheduler, tenant, admitted, release))
+            for _ in range(6) for tenant in ("a", "b")
+        ]
+        await _settle()
+        assert admitted == []
+
+        release.set()
+        await holder.__aexit__(None, None, None)
+        await asyncio.gather(*tasks)
+        return admitted
+
+    admitted = asyncio.run(scenario())
+    assert admitted[:6].count("a") == 4
+    assert admitted[:6].count("b") == 2
+    assert sorted(admitted) == ["a"] * 6 + ["b"] * 6
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        scheduler = _scheduler(tenant_concurrency=1, max_queue=1)
+        admitted, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(_hold(scheduler, "a", admitted, release)) for _ in range(2)]
+        await _settle()
+
+        with pytest.raises(TooManyRequestsError) as error:
+            async with scheduler.slot("a"):
+                pass
+
+        release.set()
+        await asyncio.gather(*tasks)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert "queue full" in error.message
+
+
+def test_queue_timeout_is_rejected_and_waiter_removed():
+    async def scenario():
+        scheduler = _scheduler(tenant_concurrency=1, queue_timeout=0.05)
+        admitted, release = [], asyncio.Event()
+        holder = asyncio.create_task(_hold(scheduler, "a", admitted, release))
+        await _settle()
+
+        with pytest.raises(TooManyRequestsError) as error:
+            async with scheduler.slot("a"):
+                pass
+        assert not scheduler._tenants["a"].waiters
+
+        release.set()
+        await holder
+        assert scheduler.in_flight == 0
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert "queue timeout" in error.message
+
+
+def test_cancelled_waiter_hands_granted_slot_to_next_waiter():
+    async def scenario():
+        scheduler = _scheduler(max_concurrency=1, tenant_concurrency=1)
+        admitted, release = [], asyncio.Event()
+        holder = scheduler.slot("holder")
+        await holder.__aenter__()
+
+        cancelled = asyncio.create_task(_hold(scheduler, "a", admitted, release))
+        waiting = asyncio.create_task(_hold(scheduler, "b", admitted, release))
+        await _settle()
+
+        # Slot is granted to the first waiter, which is cancelled before it gets to run
+        await holder.__aexit__(None, None, None)
+        assert scheduler._tenants["a"].in_flight == 1
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await _settle()
+        assert admitted == ["b"]
+        assert scheduler.in_flight == 1
+
+        release.set()
+        await waiting
+        assert scheduler.in_flight == 0
+        assert scheduler._tenants["a"].in_flight == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,171 @@
+import asyncio
+
+from aidial_sdk.chat_completion import Choice, Message, Role
+
+from task.metrics import metrics
+from task.models import AgentName, CoordinationRequest
+from task.speculation import SpeculativeDispatch
+
+
+class _Queue(list):
+
+    def put_nowait(self, chunk):
+        self.append(chunk)
+
+
+def _choice() -> Choice:
+    # Real choice as the coordinator sees it: opened, with the routing stage already created
+    choice = Choice(_Queue(), 0)
+    choice._opened = True
+    choice.create_stage("Coordination Request")
+    return choice
+
+
+def _deltas(choice: Choice) -> list[dict]:
+    return [chunk.to_dict()["choices"][0]["delta"] for chunk in choice._queue]
+
+
+async def _settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class _Agent:
+    """Agent call writing a stage chunk and an attachment before `resume`, the final stage chunk after it"""
+
+    def __init__(self):
+        self.resume = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self, coordination_request: CoordinationRequest, choice: Choice, stage) -> Message:
+        try:
+            stage.append_content("first")
+            choice.add_attachment(title="report", url="files/report.csv")
+            await self.resume.wait()
+            stage.append_content("second")
+            return Message(role=Role.ASSISTANT, content=f"{coordination_request.agent_name} answer")
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def test_commit_flushes_buffered_chunks_and_forwards_the_rest_live():
+    async def scenario():
+        choice, agent = _choice(), _Agent()
+        speculation = SpeculativeDispatch.start(agent_name=AgentName.GPA, choice=choice, run=agent)
+        await _settle()
+        # Nothing reaches the client before routing agrees
+        assert not choice._queue
+        assert speculation.queue.buffer
+
+        commit = asyncio.create_task(speculation.commit())
+        await _settle()
+        assert not speculation.queue.buffer
+        buffered = len(choice._queue)
+
+        agent.resume.set()
+        message = await commit
+        assert len(choice._queue) > buffered
+        return choice, message
+
+    choice, message = asyncio.run(scenario())
+    assert message.content == "GPA answer"
+
+    stage_contents = [
+        stage.get("content")
+        for delta in _deltas(choice)
+        for stage in delta.get("custom_content", {}).get("stages", [])
+        if stage.get("content")
+    ]
+    assert stage_contents == ["first", "second"]
+
+
+def test_commit_hands_stage_and_attachment_numbering_back_to_choice():
+    async def scenario():
+        choice, agent = _choice(), _Agent()
+        agent.resume.set()
+        speculation = SpeculativeDispatch.start(agent_name=AgentName.GPA, choice=choice, run=agent)
+        await speculation.commit()
+        return choice
+
+    choice = asyncio.run(scenario())
+    stage_indexes = {
+        stage["index"]
+        for delta in _deltas(choice)
+        for stage in delta.get("custom_content", {}).get("stages", [])
+    }
+    # Speculative stage continues after the routing stage of the real choice
+    assert stage_indexes == {1}
+    assert choice._last_stage_index == 2
+    assert choice._last_attachment_index == 1
+
+    # Next stage and attachment on the real choice do not collide with the speculative ones
+    choice.create_stage("Final").open()
+    choice.add_attachment(title="summary", url="files/summary.md")
+    last_stage, last_attachment = _deltas(choice)[-2:]
+    assert last_stage["custom_content"]["stages"][0]["index"] == 2
+    assert last_attachment["custom_content"]["attachments"][0]["index"] == 1
+
+
+def test_cancel_stops_agent_call_and_discards_buffer():
+    async def scenario():
+        choice, agent = _choice(), _Agent()
+        speculation = SpeculativeDispatch.start(agent_name=AgentName.GPA, choice=choice, run=agent)
+        await _settle()
+        await speculation.cancel()
+        return choice, agent, speculation
+
+    choice, agent, speculation = asyncio.run(scenario())
+    assert agent.cancelled
+    assert speculation.task.cancelled()
+    assert not speculation.queue.buffer
+    assert not choice._queue
+    assert choice._last_stage_index == 1
+
+
+def test_cancel_after_commit_only_stops_the_call():
+    async def scenario():
+        choice, agent = _choice(), _Agent()
+        speculation = SpeculativeDispatch.start(agent_name=AgentName.GPA, choice=choice, run=agent)
+        commit = asyncio.create_task(speculation.commit())
+        await _settle()
+        # Request fails after routing committed the speculation
+        commit.cancel()
+        await asyncio.gather(commit, return_exceptions=True)
+        await speculation.cancel()
+        return agent, speculation
+
+    agent, speculation = asyncio.run(scenario())
+    assert agent.cancelled
+    assert speculation.settled
+
+
+def test_matches_same_agent_without_additional_instructions():
+    async def scenario():
+        speculation = SpeculativeDispatch.start(agent_name=AgentName.GPA, choice=_choice(), run=_Agent())
+        try:
+            return [
+                speculation.matches(CoordinationRequest(agent_name=AgentName.GPA)),
+                speculation.matches(CoordinationRequest(agent_name=AgentName.GPA, additional_instructions="short")),
+                speculation.matches(CoordinationRequest(agent_name=AgentName.UMS)),
+            ]
+        finally:
+            await speculation.cancel()
+
+    assert asyncio.run(scenario()) == [True, False, False]
+
+
+def test_hit_rate_gauge_follows_outcomes():
+    async def scenario():
+        agent = _Agent()
+        agent.resume.set()
+        hit = SpeculativeDispatch.start(agent_name=AgentName.UMS, choice=_choice(), run=agent)
+        await hit.commit()
+        miss = SpeculativeDispatch.start(agent_name=AgentName.UMS, choice=_choice(), run=_Agent())
+        await miss.cancel()
+
+    hits = metrics.get("speculative_hits_total", agent=AgentName.UMS)
+    misses = metrics.get("speculative_misses_total", agent=AgentName.UMS)
+    asyncio.run(scenario())
+    assert metrics.get("speculative_hits_total", agent=AgentName.UMS) == hits + 1
+    assert metrics.get("speculative_hit_rate", agent=AgentName.UMS) == (hits + 1) / (hits + misses + 2)
@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from task.streaming import BufferPolicy, StreamPipeline
+
+
+async def _produce(items, produced=None, delay=0.0, error=None, closed=None):
+    try:
+        for item in items:
+            if produced is not None:
+                produced.append(item)
+            yield item
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+async def _settle():
+    # Let the reader task run until it blocks or finishes
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def _collect(pipeline):
+    return [item async for item in pipeline]
+
+
+def test_block_policy_pauses_reader_at_high_watermark():
+    async def scenario():
+        produced = []
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce(range(20), produced),
+            downstream_queue=asyncio.Queue(),
+            policy=BufferPolicy.BLOCK,
+            high_watermark=4,
+            low_watermark=2,
+        )
+        async with pipeline:
+            await _settle()
+            # Reader holds one item it cannot buffer until the consumer drains to the low watermark
+            assert len(produced) == 5
+            assert len(pipeline._buffer) == 4
+            return await _collect(pipeline)
+
+    assert asyncio.run(scenario()) == list(range(20))
+
+
+def test_coalesce_policy_merges_items_over_high_watermark():
+    async def scenario():
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce("abcdefghij"),
+            downstream_queue=asyncio.Queue(),
+            coalesce=lambda last, item: last + item,
+            policy=BufferPolicy.COALESCE,
+            high_watermark=2,
+            low_watermark=1,
+        )
+        async with pipeline:
+            await _settle()
+            return await _collect(pipeline)
+
+    items = asyncio.run(scenario())
+    assert "".join(items) == "abcdefghij"
+    assert len(items) == 2
+
+
+def test_coalesce_policy_blocks_when_items_cannot_be_merged():
+    async def scenario():
+        produced = []
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce(range(10), produced),
+            downstream_queue=asyncio.Queue(),
+            coalesce=lambda last, item: None,
+            policy=BufferPolicy.COALESCE,
+            high_watermark=3,
+            low_watermark=1,
+        )
+        async with pipeline:
+            await _settle()
+            assert len(produced) == 4
+            return await _collect(pipeline)
+
+    assert asyncio.run(scenario()) == list(range(10))
+
+
+def test_spill_policy_keeps_order_across_spill_file():
+    async def scenario():
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce(range(50)),
+            downstream_queue=asyncio.Queue(),
+            dumps=str,
+            loads=int,
+            policy=BufferPolicy.SPILL,
+            high_watermark=3,
+            low_watermark=1,
+        )
+        async with pipeline:
+            while not pipeline._done:
+                await asyncio.sleep(0)
+            assert pipeline._spill is not None and pipeline._spill.pending == 47
+            items = []
+            async for item in pipeline:
+                items.append(item)
+                # Consumer drains below the watermark while spilled items are still pending
+                await asyncio.sleep(0)
+            return items
+
+    assert asyncio.run(scenario()) == list(range(50))
+
+
+def test_upstream_error_is_raised_after_buffered_items():
+    async def scenario():
+        items = []
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce([1, 2, 3], error=ValueError("upstream failed")),
+            downstream_queue=asyncio.Queue(),
+        )
+        async with pipeline:
+            await _settle()
+            with pytest.raises(ValueError, match="upstream failed"):
+                async for item in pipeline:
+                    items.append(item)
+        return items
+
+    assert asyncio.run(scenario()) == [1, 2, 3]
+
+
+def test_early_consumer_exit_stops_reader():
+    async def scenario():
+        closed = asyncio.Event()
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce(range(1000), delay=0.001, closed=closed),
+            downstream_queue=asyncio.Queue(),
+        )
+        async with pipeline:
+            async for item in pipeline:
+                assert item == 0
+                break
+        await asyncio.wait_for(closed.wait(), timeout=1)
+        return pipeline._reader
+
+    reader = asyncio.run(scenario())
+    assert reader.done()
+
+
+def test_consumer_waits_for_downstream_queue_to_drain():
+    async def scenario():
+        queue = asyncio.Queue()
+        pipeline = StreamPipeline(
+            name="test",
+            upstream=_produce(range(10)),
+            downstream_queue=queue,
+            downstream_high_watermark=2,
+        )
+
+        async def write():
+            async for item in pipeline:
+                queue.put_nowait(item)
+
+        async with pipeline:
+            writer = asyncio.create_task(write())
+            await _settle()
+            # Writer stops once the response queue holds more than the downstream watermark
+            assert queue.qsize() == 3
+            assert not writer.done()
+
+            received = []
+            while len(received) < 10:
+                received.append(await queue.get())
+                queue.task_done()
+            await writer
+        return received
+
+    assert asyncio.run(scenario()) == list(range(10))